@@ -1,9 +1,12 @@
-import logging
+import asyncio
 import json
+import logging
 import time
-from typing import List, Optional
-from fastapi import APIRouter, HTTPException
-from fastapi.responses import StreamingResponse
+from functools import lru_cache
+from typing import Generator, List, Optional
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import Response, StreamingResponse
+from starlette.concurrency import iterate_in_threadpool
 from models import (
     ChatCompletionRequest,
     ChatCompletionResponse,
@@ -12,8 +15,9 @@ from models import (
     HealthResponse,
     ChatCompletionChunk
 )
-from services import ChatGPTService
-from utils import get_current_timestamp, create_error_response
+from services import ChatGPTService, ThinkingMessageFilter
+from config import settings
+from utils import generate_id, get_current_timestamp, create_error_response
 
 logger = logging.getLogger(__name__)
 
@@ -23,9 +27,17 @@ router = APIRouter()
 # サービスインスタンス（遅延初期化）
 chatgpt_service: Optional[ChatGPTService] = None
 
+# ワーカースレッドへ渡すチャット補完の同時実行数を制限する
+# （ブラウザは1つなので、上限を超えた分はスレッドを占有せずイベントループ上で待たせる）
+completion_semaphore = asyncio.Semaphore(max(1, settings.max_concurrent_completions))
+
 
-def get_chatgpt_service() -> ChatGPTService:
-    """ChatGPTサービスのインスタンスを取得（遅延初期化）"""
+async def get_chatgpt_service() -> ChatGPTService:
+    """ChatGPTサービスのインスタンスを取得（遅延初期化）
+
+    エンドポイントへはDependsで注入する（テストではapp.dependency_overridesで差し替える）。
+    インスタンス生成はブラウザを起動せず軽量なため、スレッドプールを経由しないasync関数とする。
+    """
     global chatgpt_service
     if chatgpt_service is None:
         logger.info("Initializing ChatGPT Service...")
@@ -36,52 +48,107 @@ def get_chatgpt_service() -> ChatGPTService:
     return chatgpt_service
 
 
-def generate_streaming_response(content: str, request: ChatCompletionRequest):
-    """ストリーミングレスポンスを生成"""
+# SSEレスポンス共通ヘッダー
+_SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive"
+}
+
+# 要素の取得に失敗して模擬応答が返った場合のエラーメッセージ
+_SERVICE_UNAVAILABLE_MESSAGE = (
+    "ChatGPTサービスが一時的に利用できません。要素の取得に失敗しました。しばらく後に再試行してください。\n\n"
+    "ChatGPT service is temporarily unavailable. Failed to retrieve elements. Please try again later."
+)
+
+
+def _is_mock_response(content: str) -> bool:
+    """実際のChatGPT応答ではなく模擬応答が返ったかどうか"""
+    return "模擬応答" in content or "mock response" in content
+
+
+def _sse_error_event(code: str, message: str) -> str:
+    """ストリーミング途中のエラーをSSEの1イベントとして生成"""
+    return f"data: {json.dumps(create_error_response(code, message), ensure_ascii=False)}\n\n"
+
+
+def _build_sse_chunk(response_id: str, created: int, model: str, delta: dict, finish_reason: Optional[str]) -> str:
+    """ストリーミング用チャンクをSSEの1イベントとして生成"""
+    # 値は構築済みなのでバリデーションを省略してそのままシリアライズする
+    chunk = ChatCompletionChunk.model_construct(
+        id=response_id,
+        created=created,
+        model=model,
+        choices=[{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+    )
+    return f"data: {chunk.model_dump_json()}\n\n"
+
+
+async def generate_streaming_response(content: str, request: ChatCompletionRequest, response_id: str, created: int):
+    """取得済みの応答を分割してストリーミングレスポンス（Server-Sent Events）を生成"""
     chunk_size = 20  # 文字単位
-    response_id = f"chatcmpl-{int(time.time())}"
-    created_time = int(time.time())
+
+    # 最初のチャンクでロールを通知（OpenAI互換）
+    yield _build_sse_chunk(response_id, created, request.model, {"role": "assistant"}, None)
 
     # コンテンツを文字単位で分割してストリーミング
     for i in range(0, len(content), chunk_size):
-        chunk_content = content[i:i + chunk_size]
-        is_last_chunk = i + chunk_size >= len(content)
-
-        chunk_data = {
-            "id": response_id,
-            "object": "chat.completion.chunk",
-            "created": created_time,
-            "model": request.model,
-            "choices": [{
-                "index": 0,
-                "delta": {
-                    "content": chunk_content
-                } if not is_last_chunk else {},
-                "finish_reason": None if not is_last_chunk else "stop"
-            }]
-        }
-
-        yield f"data: {json.dumps(chunk_data, ensure_ascii=False)}\n\n"
-        time.sleep(0.1)  # ストリーミング感を演出
+        yield _build_sse_chunk(response_id, created, request.model, {"content": content[i:i + chunk_size]}, None)
 
     # 最終チャンク（空のdelta）
-    final_chunk = {
-        "id": response_id,
-        "object": "chat.completion.chunk",
-        "created": created_time,
-        "model": request.model,
-        "choices": [{
-            "index": 0,
-            "delta": {},
-            "finish_reason": "stop"
-        }]
-    }
-    yield f"data: {json.dumps(final_chunk, ensure_ascii=False)}\n\n"
+    yield _build_sse_chunk(response_id, created, request.model, {}, "stop")
     yield "data: [DONE]\n\n"
 
 
+async def relay_streaming_response(deltas: Generator[str, None, None], request: ChatCompletionRequest, response_id: str, created: int):
+    """ブラウザ上で生成中の応答テキストを増分ごとにSSEとして中継
+
+    非ストリーミング時と同じく考え中メッセージを除去し、除去後に内容が残らない場合や
+    模擬応答だった場合は、完了（stop）の代わりにエラーイベントを送って終了する。
+    """
+    async with completion_semaphore:
+        yield _build_sse_chunk(response_id, created, request.model, {"role": "assistant"}, None)
+
+        thinking_filter = ThinkingMessageFilter()
+        content_parts = []
+        try:
+            # ドライバーのポーリングはブロッキングなので、増分の取得はワーカースレッドで行う
+            async for delta in iterate_in_threadpool(deltas):
+                content = thinking_filter.feed(delta)
+                if content:
+                    content_parts.append(content)
+                    yield _build_sse_chunk(response_id, created, request.model, {"content": content}, None)
+            content = thinking_filter.flush()
+            if content:
+                content_parts.append(content)
+                yield _build_sse_chunk(response_id, created, request.model, {"content": content}, None)
+        except Exception as e:
+            # ヘッダー送信後なのでステータスコードは変えられない。エラーイベントを送って終了する
+            logger.error(f"Error while streaming chat completion: {e}")
+            code = "authentication_required" if "ログイン" in str(e) or "login" in str(e).lower() else "internal_error"
+            yield _sse_error_event(code, str(e))
+            return
+        finally:
+            # クライアント切断時もGCを待たずに閉じ、ドライバーのロックを解放する
+            # （ワーカースレッドのnext()はキャンセルされず戻るまで待つため、実行中のジェネレーターを閉じることはない）
+            deltas.close()
+
+        if thinking_filter.removed:
+            logger.warning("Detected thinking message pattern (%d occurrence(s))", thinking_filter.removed)
+        content = "".join(content_parts)
+        if not content.strip():
+            logger.error("No content remaining after filtering thinking message - possible incomplete response")
+            yield _sse_error_event("internal_error", "Failed to generate chat completion")
+            return
+        if _is_mock_response(content):
+            yield _sse_error_event("service_unavailable", _SERVICE_UNAVAILABLE_MESSAGE)
+            return
+
+        yield _build_sse_chunk(response_id, created, request.model, {}, "stop")
+        yield "data: [DONE]\n\n"
+
+
 @router.post("/v1/chat/completions")
-async def create_chat_completion(request: ChatCompletionRequest):
+async def create_chat_completion(request: ChatCompletionRequest, service: ChatGPTService = Depends(get_chatgpt_service)):
     """チャット補完API"""
     try:
         # 詳細なリクエストログ
@@ -107,8 +174,29 @@ async def create_chat_completion(request: ChatCompletionRequest):
 
         logger.info(f"Received chat completion request for model: {request.model}")
 
-        # チャット補完を実行
-        response = get_chatgpt_service().create_chat_completion(request)
+        # 通常チャットのストリーミングは、ブラウザ上で生成中の応答をそのまま中継する
+        if request.stream and not (request.functions or request.tools):
+            async with completion_semaphore:
+                deltas = await asyncio.to_thread(service.create_chat_completion_stream, request)
+
+            if deltas is None:
+                raise HTTPException(
+                    status_code=500,
+                    detail=create_error_response(
+                        "internal_error",
+                        "Failed to generate chat completion"
+                    )
+                )
+
+            return StreamingResponse(
+                relay_streaming_response(deltas, request, generate_id(), get_current_timestamp()),
+                media_type="text/event-stream",
+                headers=_SSE_HEADERS
+            )
+
+        # チャット補完を実行（ブラウザ操作はブロッキングなのでワーカースレッドへ逃がし、イベントループを塞がない）
+        async with completion_semaphore:
+            response = await asyncio.to_thread(service.create_chat_completion, request)
 
         if not response:
             raise HTTPException(
@@ -119,31 +207,29 @@ async def create_chat_completion(request: ChatCompletionRequest):
                 )
             )
 
-        # ストリーミングが要求された場合
+        # ストリーミングが要求された場合（Function Calling時は取得済みの応答を分割して配信）
         if request.stream:
             # レスポンスからコンテンツを取得
             content = response.choices[0].message.content if response.choices and response.choices[0].message.content else ""
 
             # 模擬応答の検出と適切な処理
-            if "模擬応答" in content or "mock response" in content:
+            if _is_mock_response(content):
                 # 実際のChatGPT応答が取得できていない場合はエラーレスポンス
                 raise HTTPException(
                     status_code=503,
-                    detail=create_error_response(
-                        "service_unavailable",
-                        "ChatGPTサービスが一時的に利用できません。要素の取得に失敗しました。しばらく後に再試行してください。\n\nChatGPT service is temporarily unavailable. Failed to retrieve elements. Please try again later."
-                    )
+                    detail=create_error_response("service_unavailable", _SERVICE_UNAVAILABLE_MESSAGE)
                 )
 
             # ストリーミングレスポンスを返す
             return StreamingResponse(
-                generate_streaming_response(content, request),
-                media_type="text/plain; charset=utf-8",
-                headers={
-                    "Cache-Control": "no-cache",
-                    "Connection": "keep-alive",
-                    "Content-Type": "text/plain; charset=utf-8"
-                }
+                generate_streaming_response(
+                    content,
+                    request,
+                    getattr(response, 'id', None) or generate_id(),
+                    getattr(response, 'created', None) or get_current_timestamp()
+                ),
+                media_type="text/event-stream",
+                headers=_SSE_HEADERS
             )
 
         # 通常のレスポンス（非ストリーミング）
@@ -153,13 +239,10 @@ async def create_chat_completion(request: ChatCompletionRequest):
                 choice = response.choices[0]
                 if hasattr(choice, 'message') and hasattr(choice.message, 'content') and choice.message.content:
                     content = choice.message.content
-                    if "模擬応答" in content or "mock response" in content:
+                    if _is_mock_response(content):
                         raise HTTPException(
                             status_code=503,
-                            detail=create_error_response(
-                                "service_unavailable",
-                                "ChatGPTサービスが一時的に利用できません。要素の取得に失敗しました。しばらく後に再試行してください。\n\nChatGPT service is temporarily unavailable. Failed to retrieve elements. Please try again later."
-                            )
+                            detail=create_error_response("service_unavailable", _SERVICE_UNAVAILABLE_MESSAGE)
                         )
         except (AttributeError, IndexError, TypeError):
             # モックオブジェクトや不正な構造の場合は模擬応答チェックをスキップ
@@ -247,30 +330,36 @@ async def create_chat_completion(request: ChatCompletionRequest):
         )
 
 
+@lru_cache(maxsize=1)
+def _models_response_body() -> bytes:
+    """モデル一覧レスポンスのJSON本文（内容は固定のため初回に1回だけシリアライズする）"""
+    # ChatGPTのWebインターフェースで利用可能なモデルを返す
+    models = [
+        ModelInfo(
+            id="gpt-3.5-turbo",
+            created=1677610602,
+            owned_by="openai"
+        ),
+        ModelInfo(
+            id="gpt-4",
+            created=1687882411,
+            owned_by="openai"
+        ),
+        ModelInfo(
+            id="gpt-4-turbo-preview",
+            created=1706037612,
+            owned_by="openai"
+        )
+    ]
+    return ModelsResponse(data=models).model_dump_json().encode("utf-8")
+
+
 @router.get("/v1/models", response_model=ModelsResponse)
 async def list_models():
     """利用可能なモデル一覧API"""
     try:
-        # ChatGPTのWebインターフェースで利用可能なモデルを返す
-        models = [
-            ModelInfo(
-                id="gpt-3.5-turbo",
-                created=1677610602,
-                owned_by="openai"
-            ),
-            ModelInfo(
-                id="gpt-4",
-                created=1687882411,
-                owned_by="openai"
-            ),
-            ModelInfo(
-                id="gpt-4-turbo-preview",
-                created=1706037612,
-                owned_by="openai"
-            )
-        ]
-
-        return ModelsResponse(data=models)
+        # response_modelはOpenAPIスキーマ用。本文は生成済みのJSONをそのまま返す
+        return Response(content=_models_response_body(), media_type="application/json")
 
     except Exception as e:
         logger.error(f"Error listing models: {e}")
@@ -284,10 +373,10 @@ async def list_models():
 
 
 @router.get("/health", response_model=HealthResponse)
-async def health_check():
+async def health_check(service: ChatGPTService = Depends(get_chatgpt_service)):
     """ヘルスチェックAPI"""
     try:
-        is_healthy = get_chatgpt_service().health_check()
+        is_healthy = service.health_check()
         status = "healthy" if is_healthy else "unhealthy"
 
         return HealthResponse(
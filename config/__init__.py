@@ -34,6 +34,11 @@ class Settings(BaseSettings):
     init_timeout: int = 15              # 初期化タイムアウト（秒）
     residual_cleanup: bool = True       # 残存データクリーンアップ有効/無効
 
+    # リクエスト処理設定
+    max_concurrent_completions: int = 4  # 同時にワーカースレッドへ渡すチャット補完の上限
+    response_cache_size: int = 0         # 同一メッセージへの応答を再利用する件数（0で無効）
+    coalesce_requests: bool = False      # 処理中の同一メッセージには送信せず、その応答を共有する
+
     # ログ設定
     log_level: str = "INFO"
 
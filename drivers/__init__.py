@@ -1,6 +1,6 @@
 import logging
 import time
-from typing import Optional, Dict, Any, Union, List
+from typing import Optional, Dict, Any, Union, List, Iterator, Tuple
 
 from selenium.webdriver.common.by import By
 from selenium.webdriver.common.keys import Keys
@@ -14,6 +14,16 @@ from .selenium_wrapper import SeleniumWrapper
 
 logger = logging.getLogger(__name__)
 
+# 入力欄へテキストを一括挿入するJavaScript
+# send_keysはブラウザ側で1文字ずつキーイベントを合成するため、長文ほど時間がかかる。
+# execCommand('insertText') は textarea と contenteditable（ChatGPTの入力欄）の両方で
+# 通常の入力と同じ input イベントを発生させるため、画面側の状態も正しく更新される。
+_INSERT_TEXT_JS = """
+const element = arguments[0];
+element.focus();
+return document.execCommand('insertText', false, arguments[1]);
+"""
+
 
 class ChatGPTDriver:
     """ChatGPT WebDriverラッパークラス - SeleniumWrapper使用版"""
@@ -22,6 +32,14 @@ class ChatGPTDriver:
         self.selenium_wrapper: Optional[SeleniumWrapper] = None
         self.wait: Optional[WebDriverWait] = None
         self._session_active = False
+        self._chunk_threshold = 4000  # これを超える長さはスマート分割送信
+        self.invalidate_settings_cache()
+
+    def invalidate_settings_cache(self) -> None:
+        """送信戦略の閾値を設定から読み直す（settingsを変更した後に呼ぶ）"""
+        safe_limit = getattr(settings, 'safe_send_limit', 150)
+        # 未設定・0以下などの不正値はデフォルト値にフォールバック
+        self._safe_limit = safe_limit if isinstance(safe_limit, int) and safe_limit > 0 else 150
 
     def start_session(self) -> bool:
         """ブラウザセッションを開始"""
@@ -163,6 +181,88 @@ class ChatGPTDriver:
         Raises:
             RuntimeError: ログインセッション期限切れまたは応答取得失敗
         """
+        response_text = ""
+        for _, response_text in self._send_and_poll_response(message):
+            pass
+        logger.info(f"Got response: {response_text[:100]}...")
+        return response_text
+
+    def send_message_stream(self, message: str) -> Iterator[str]:
+        """
+        ChatGPTにメッセージを送信し、応答テキストの増分を生成途中から逐次返す
+
+        Args:
+            message (str): 送信するメッセージ
+
+        Yields:
+            str: 前回から追加された応答テキスト
+
+        Raises:
+            RuntimeError: ログインセッション期限切れまたは応答取得失敗
+        """
+        emitted = ""
+        snapshot = ""
+        stream_selector = None
+        for selector, snapshot in self._send_and_poll_response(message):
+            if selector != stream_selector:
+                # 一致するセレクターが変わると取得範囲も変わるため、同じセレクターで次に更新されるまで送出しない
+                if stream_selector is not None:
+                    logger.debug(f"Response selector changed while streaming: {stream_selector} -> {selector}")
+                stream_selector = selector
+                continue
+
+            sent, matched = self._align_streamed_text(emitted, snapshot)
+            if emitted[sent:].strip():
+                # 描画の都合で既出部分が書き換わった場合は取り消せないため、追記分が揃うまで待つ
+                logger.debug("Streamed prefix was rewritten in the DOM, waiting for it to be extended")
+                continue
+            if len(snapshot) > matched:
+                yield snapshot[matched:]
+                emitted = snapshot
+
+        # 完成した応答のうち未送出の末尾を送る（最後の更新がセレクター切り替え直後だった場合を含む）
+        sent, matched = self._align_streamed_text(emitted, snapshot)
+        if emitted[sent:].strip():
+            # 送出済みの部分は取り消せないため、応答を打ち切らず一致した位置以降を送る
+            logger.warning(
+                f"Streamed text disagrees with the final response after {matched} chars; "
+                f"{len(emitted) - sent} sent chars were not part of it"
+            )
+        if len(snapshot) > matched:
+            yield snapshot[matched:]
+            emitted = snapshot
+
+        logger.info(f"Streamed response: {len(emitted)} chars")
+
+    @staticmethod
+    def _align_streamed_text(emitted: str, snapshot: str) -> Tuple[int, int]:
+        """
+        送出済みのテキストとsnapshotを先頭から照合し、一致した位置を(emitted側, snapshot側)で返す
+
+        セレクターの切り替えなどで空白の入り方が変わっても一致とみなせるよう、空白は読み飛ばして照合する。
+        """
+        if snapshot.startswith(emitted):
+            return len(emitted), len(emitted)
+
+        i = j = 0
+        while i < len(emitted) and j < len(snapshot):
+            if emitted[i] == snapshot[j]:
+                i += 1
+                j += 1
+            elif emitted[i].isspace():
+                i += 1
+            elif snapshot[j].isspace():
+                j += 1
+            else:
+                break
+        return i, j
+
+    def _send_and_poll_response(self, message: str) -> Iterator[Tuple[str, str]]:
+        """
+        メッセージを送信し、応答テキストが更新されるたびに（応答要素のセレクター, その時点の全文）を返すジェネレーター
+
+        最後に返したテキストが完成した応答になる。応答が取得できない場合はRuntimeErrorを送出する。
+        """
         try:
             logger.info(f"Starting optimized message sending: {len(message)} chars")
 
@@ -294,6 +394,7 @@ class ChatGPTDriver:
             ]
 
             response_element = None
+            response_selector = None
             response_text = ""
 
             # 応答完了まで待機（既存のロジックを維持）
@@ -315,10 +416,12 @@ class ChatGPTDriver:
                                 current_text = candidate_element.text.strip()
                                 if current_text:
                                     response_element = candidate_element
+                                    response_selector = selector
                                     if current_text != response_text:
                                         response_text = current_text
                                         last_text_update = time.time()
                                         logger.debug(f"Updated response text ({len(current_text)} chars)")
+                                        yield response_selector, response_text
                                     logger.debug(f"Found response with selector: {selector}")
                                     break
                     except (StaleElementReferenceException, NoSuchElementException):
@@ -389,6 +492,7 @@ class ChatGPTDriver:
                             response_text = new_text
                             last_text_update = time.time()
                             logger.debug(f"Response text updated: {len(response_text)} chars")
+                            yield response_selector, response_text
                     except StaleElementReferenceException:
                         response_element = None
                         continue
@@ -397,8 +501,7 @@ class ChatGPTDriver:
                 time.sleep(0.5)
 
             if response_element and response_text:
-                logger.info(f"Got response: {response_text[:100]}...")
-                return response_text
+                return
 
             # レスポンスが見つからない場合
             if not self._check_login_status():
@@ -421,6 +524,10 @@ class ChatGPTDriver:
     def _enhanced_cleanup(self, input_element) -> str:
         """段階的クリーンアップ処理（最適化版）"""
         try:
+            # 入力欄が既に空なら何もしない（clear・待機・再確認のWebDriver往復を省く）
+            if not (input_element.get_attribute('value') or input_element.text):
+                return ""
+
             # 段階1: 標準クリーンアップ
             input_element.clear()
             time.sleep(settings.input_cleanup_delay if hasattr(settings, 'input_cleanup_delay') else 0.8)
@@ -448,27 +555,39 @@ class ChatGPTDriver:
     
     def _select_send_strategy(self, message_length: int) -> str:
         """送信戦略選択（科学的根拠に基づく）"""
-        safe_limit = getattr(settings, 'safe_send_limit', 150)
-        
-        if message_length <= safe_limit:
+        # 閾値は invalidate_settings_cache で検証済みの値を使う（送信ごとに設定を読み直さない）
+        if message_length <= self._safe_limit:
             return "safe_single"
-        elif message_length <= 4000:
+        elif message_length <= self._chunk_threshold:
             return "try_single_fallback_chunk"
         else:
             return "smart_chunking"
     
+    def _js_paste(self, input_element, text: str) -> None:
+        """JavaScriptで入力欄にテキストを一括挿入（WebDriverへの往復は1回）
+
+        挿入できなかった場合は例外を送出する（呼び出し側でsend_keysやチャンキングにフォールバックする）。
+        """
+        inserted = self.selenium_wrapper.driver.execute_script(_INSERT_TEXT_JS, input_element, text)
+        if not inserted:
+            raise RuntimeError("insertTextによるテキスト挿入に失敗しました")
+
     def _execute_send_strategy(self, input_element, message: str, strategy: str):
         """選択された送信戦略の実行"""
         try:
             if strategy == "safe_single":
-                # 短いメッセージは確実に単一送信
-                input_element.send_keys(message)
+                # 短いメッセージはJavaScriptで一括挿入し、失敗時のみキー入力で確実に送る
+                try:
+                    self._js_paste(input_element, message)
+                except Exception as e:
+                    logger.warning(f"JS insert failed: {e}, falling back to send_keys")
+                    input_element.send_keys(message)
                 logger.debug(f"Executed safe_single strategy: {len(message)} chars")
             
             elif strategy == "try_single_fallback_chunk":
-                # 単一送信試行、失敗時はチャンキング
+                # 単一挿入試行、失敗時はチャンキング
                 try:
-                    input_element.send_keys(message)
+                    self._js_paste(input_element, message)
                     logger.debug(f"Executed try_single strategy successfully: {len(message)} chars")
                 except Exception as e:
                     logger.warning(f"Single send failed: {e}, falling back to chunking")
@@ -524,7 +643,8 @@ class ChatGPTDriver:
             input_element: テキスト入力要素
             message (str): 送信するメッセージ
         """
-        max_chunk_size = 3500  # より安全なサイズに縮小
+        # JavaScriptで1チャンクずつ一括挿入するため、チャンクは大きくしてWebDriverとの往復回数を減らす
+        max_chunk_size = max(self._safe_limit * 20, self._chunk_threshold)
 
         # 改行位置での分割を優先
         paragraphs = message.split('\n\n')
@@ -555,14 +675,17 @@ class ChatGPTDriver:
         logger.warning(f"Smart chunking required: {len(chunks)} chunks. This may cause system message separation.")
 
         for i, chunk in enumerate(chunks):
-            input_element.send_keys(chunk)
+            try:
+                self._js_paste(input_element, chunk)
+            except Exception as e:
+                logger.warning(f"JS insert failed for chunk {i+1}: {e}, falling back to send_keys")
+                input_element.send_keys(chunk)
             logger.debug(f"Sent smart chunk {i+1}/{len(chunks)}: {len(chunk)} chars")
 
-            # チャンク間の適切な待機（Stop button監視）
+            # チャンク間の適切な待機（Stop button監視、WebDriverWaitによる待機のみで固定のsleepはしない）
             if i < len(chunks) - 1:  # 最後のチャンク以外
                 logger.info("Waiting for stop button to disappear before sending next chunk...")
                 self._wait_for_stop_button_disappear()
-                time.sleep(1.0)  # 追加の安全待機
 
     def _contains_system_message(self, message: str) -> bool:
         """メッセージにシステムメッセージが含まれているかチェック"""
@@ -29,8 +29,7 @@ async def lifespan(app: FastAPI):
     try:
         if settings.auto_start_browser:
             logger.info("Auto-starting browser...")
-            # get_chatgpt_service()は同期関数なのでawaitは不要
-            chatgpt_service = get_chatgpt_service()
+            chatgpt_service = await get_chatgpt_service()
 
             # ブラウザの初期化は同期で行う
             chatgpt_service._initialize_session()
@@ -53,7 +52,7 @@ async def lifespan(app: FastAPI):
         logger.info("Application lifespan ending...")
         # クリーンアップ処理
         try:
-            chatgpt_service = get_chatgpt_service()
+            chatgpt_service = await get_chatgpt_service()
             chatgpt_service.cleanup()
         except Exception as e:
             logger.error(f"Error during cleanup: {e}")
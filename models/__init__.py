@@ -1,4 +1,4 @@
-from typing import List, Optional, Dict, Any, Union
+from typing import List, Optional, Dict, Any, Union, Literal
 from pydantic import BaseModel
 
 
@@ -84,7 +84,7 @@ class ChatCompletionUsage(BaseModel):
 class ChatCompletionResponse(BaseModel):
     """チャット補完レスポンスモデル"""
     id: str
-    object: str = "chat.completion"
+    object: Literal["chat.completion"] = "chat.completion"
     created: int
     model: str
     choices: List[ChatCompletionChoice]
@@ -94,14 +94,14 @@ class ChatCompletionResponse(BaseModel):
 class ModelInfo(BaseModel):
     """モデル情報モデル"""
     id: str
-    object: str = "model"
+    object: Literal["model"] = "model"
     created: int
     owned_by: str
 
 
 class ModelsResponse(BaseModel):
     """モデル一覧レスポンスモデル"""
-    object: str = "list"
+    object: Literal["list"] = "list"
     data: List[ModelInfo]
 
 
@@ -114,7 +114,7 @@ class HealthResponse(BaseModel):
 class ChatCompletionChunk(BaseModel):
     """ストリーミング用チャット補完チャンクモデル"""
     id: str
-    object: str = "chat.completion.chunk"
+    object: Literal["chat.completion.chunk"] = "chat.completion.chunk"
     created: int
     model: str
     choices: List[Dict[str, Any]]
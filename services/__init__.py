@@ -1,17 +1,199 @@
+import hashlib
+import json
 import logging
-from typing import Optional, List
-from models import ChatMessage, ChatCompletionRequest, ChatCompletionResponse, ChatCompletionChoice, ChatCompletionUsage
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import contextmanager
+from functools import lru_cache
+from operator import attrgetter
+from typing import Optional, List, Tuple, Dict, Generator, Iterator
+from models import ChatMessage, ChatCompletionRequest, ChatCompletionResponse, ChatCompletionChoice, ChatCompletionUsage, FunctionCall, ToolCall
 from drivers import ChatGPTDriver
+from config import settings
 from utils import generate_id, get_current_timestamp
 
 logger = logging.getLogger(__name__)
 
 
+_get_content = attrgetter("content")
+
+
+def _prompt_chars(messages: List[ChatMessage]) -> int:
+    """メッセージ本文の合計文字数を返す（トークン数推定用）
+
+    ループをmap/filterでC実装側に寄せ、要素ごとのPythonレベルの属性参照・条件分岐を避ける。
+    content が None のメッセージ（function_call のみの応答など）は filter で除外する。
+    """
+    return sum(map(len, filter(None, map(_get_content, messages))))
+
+
+@lru_cache(maxsize=128)
+def _action_args_re(action_name: str) -> "re.Pattern[str]":
+    """Action: function_name の後に続く引数JSONを抽出する正規表現（関数名ごとにキャッシュ）"""
+    return re.compile(r'Action:\s*' + re.escape(action_name) + r'[^\{]*(\{[^}]*\})', re.DOTALL | re.IGNORECASE)
+
+
+# 応答中の '{' 位置からJSONオブジェクトを1つだけ読み取るデコーダ（raw_decodeは末尾の余分な文字を許容する）
+_JSON_DECODER = json.JSONDecoder()
+
+
+# Function Call検出用の正規表現（呼び出しごとのコンパイル・キャッシュ参照を避けるため事前コンパイル）
+# 2つのAction形式を1つの選択パターンにまとめ、応答を1回走査してどちらに一致したかで振り分ける
+#   action_full:   Action: {"action": "...", "action_input": ...} 形式
+#   action_simple: Action: function_name 形式
+_ACTION_DISPATCH_RE = re.compile(
+    r'(?P<action_full>Action:\s*\{[^}]*"action"\s*:\s*"(?P<a_name>[^"]+)"[^}]*"action_input"\s*:\s*(?P<a_input>\{[^}]*\}|"[^"]*")[^}]*\})'
+    r'|(?P<action_simple>Action:\s*(?P<s_name>[a-zA-Z_][a-zA-Z0-9_]*))',
+    re.DOTALL | re.IGNORECASE
+)
+# Action: {...} より前の本文
+_PRE_ACTION_RE = re.compile(r'(.*?)Action:\s*\{[^}]*\}', re.DOTALL | re.IGNORECASE)
+
+# ChatGPTの「考え中」メッセージ（まとめて1回の走査で除去する）
+_THINKING_PHRASES = (
+    "I am thinking about how to help you",
+    "I'm thinking about how to help you",
+    "Let me think about how to help you",
+)
+_THINKING_RE = re.compile(
+    "(?:" + "|".join(re.escape(phrase) for phrase in _THINKING_PHRASES) + r")[.\s]*",
+    re.IGNORECASE
+)
+# 末尾が考え中メッセージ（＋区切り文字）で終わっているか
+_THINKING_TAIL_RE = re.compile(
+    "(?:" + "|".join(re.escape(phrase) for phrase in _THINKING_PHRASES) + r")[.\s]*\Z",
+    re.IGNORECASE
+)
+# 考え中メッセージの書き出しになり得る文字列（小文字、メッセージ全体は含まない）
+_THINKING_PREFIXES = frozenset(
+    phrase.lower()[:end] for phrase in _THINKING_PHRASES for end in range(1, len(phrase))
+)
+_THINKING_PREFIX_MAX_LEN = max(map(len, _THINKING_PHRASES)) - 1
+
+# セッション有効性チェック結果を再利用する秒数
+_SESSION_CHECK_TTL = 1.0
+
+# Function定義セットごとにレンダリング済みのコンテキストを保持する件数
+_FUNCTION_CONTEXT_CACHE_SIZE = 128
+
+
+def _extract_pre_action(response_content: str) -> Tuple[bool, Optional[str]]:
+    """Action形式かどうかと、Actionより前の本文（空ならNone）を返す"""
+    if "Action:" not in response_content:
+        return False, None
+    match = _PRE_ACTION_RE.search(response_content)
+    content_before_action = match.group(1).strip() if match else None
+    return True, (content_before_action or None)
+
+
+def _normalize_function_call(func_call: dict) -> dict:
+    """JSON形式で検出したfunction_callを {"name": str, "arguments": JSON文字列} に揃える"""
+    arguments = func_call.get("arguments", "{}")
+    if not isinstance(arguments, str):
+        arguments = json.dumps(arguments, ensure_ascii=False)
+    return {"name": func_call["name"], "arguments": arguments}
+
+
+@lru_cache(maxsize=_FUNCTION_CONTEXT_CACHE_SIZE)
+def _render_function_context(functions_key: Tuple[Tuple[str, str, str], ...]) -> str:
+    """Function定義セットからプロンプト用コンテキストを生成（同一セットはキャッシュから返す）
+
+    functions_key は (name, description, parametersのJSON文字列) のタプル。
+    パラメータの並び順は出力に反映されるため、JSON化の際にキーをソートしない。
+    """
+    # より自然なプロンプトエンジニアリングを使用
+    # 文字列の += 連結は毎回コピーが発生するため、リストに積んで最後に一括結合する
+    parts = ["I have access to the following functions that I can call to help answer your question:\n\n"]
+
+    for name, description, parameters_json in functions_key:
+        parts.append(f"Function: {name}\nDescription: {description}\n")
+
+        # パラメータをわかりやすく説明
+        parameters = json.loads(parameters_json)
+        if parameters:
+            params = parameters.get('properties', {})
+            required = parameters.get('required', [])
+
+            parts.append("Parameters:\n")
+            for param_name, param_info in params.items():
+                param_type = param_info.get('type', 'string')
+                param_desc = param_info.get('description', '')
+                req_text = " (required)" if param_name in required else " (optional)"
+                parts.append(f"  - {param_name} ({param_type}){req_text}: {param_desc}\n")
+
+        parts.append("\n")
+
+    parts.append(
+        "When you need to call a function, please respond with a JSON object in this exact format:\n"
+        '{"function_call": {"name": "function_name", "arguments": "{\\"parameter\\": \\"value\\"}"}}\n\n'
+        "Make sure to use proper JSON formatting with escaped quotes in the arguments.\n\n"
+    )
+
+    return "".join(parts)
+
+
+class ThinkingMessageFilter:
+    """ストリーミング中の応答テキストから考え中メッセージを除去するフィルター
+
+    増分をfeed()に渡すと、送出してよいテキストを返す。考え中メッセージの途中で
+    増分が区切られても除去できるよう、その書き出しになり得る末尾は確定するまで保留し、
+    応答の終了時にflush()で残りを返す。
+    """
+
+    def __init__(self):
+        self._pending = ""
+        # 除去した考え中メッセージの件数
+        self.removed = 0
+
+    def feed(self, delta: str) -> str:
+        """増分を受け取り、送出してよいテキストを返す"""
+        text = self._pending + delta
+        hold = self._holdback_start(text)
+        self._pending = text[hold:]
+        return self._strip(text[:hold])
+
+    def flush(self) -> str:
+        """保留中のテキストを返す（応答の終了時に呼ぶ）"""
+        text, self._pending = self._pending, ""
+        return self._strip(text)
+
+    def _strip(self, text: str) -> str:
+        text, removed = _THINKING_RE.subn("", text)
+        self.removed += removed
+        return text
+
+    @staticmethod
+    def _holdback_start(text: str) -> int:
+        """末尾のうち、後続の増分次第で除去対象になり得る部分の開始位置を返す"""
+        # 考え中メッセージで終わっている場合は、続く区切り文字ごと除去できるよう保留する
+        match = _THINKING_TAIL_RE.search(text)
+        hold = match.start() if match else len(text)
+        for start in range(max(0, len(text) - _THINKING_PREFIX_MAX_LEN), hold):
+            if text[start:].lower() in _THINKING_PREFIXES:
+                return start
+        return hold
+
+
 class ChatGPTService:
     """ChatGPT制御サービスクラス"""
 
     def __init__(self):
         self.driver = ChatGPTDriver()
+        # ブラウザは1つしかないため、ワーカースレッドからのドライバー操作を直列化する
+        self._driver_lock = threading.Lock()
+        # 直近でセッション有効を確認した時刻（0.0は未確認）
+        self._session_checked_at = 0.0
+        # 送信メッセージ完全一致の応答キャッシュ（LRU、0で無効）
+        self._response_cache_size = max(0, settings.response_cache_size)
+        self._response_cache: "OrderedDict[bytes, str]" = OrderedDict()
+        self._response_cache_lock = threading.Lock()
+        # 処理中の送信メッセージごとの応答Future（同時に届いた同一メッセージは1回だけ送信する）
+        self._coalesce_requests = settings.coalesce_requests
+        self._inflight: "Dict[bytes, Future]" = {}
+        self._inflight_lock = threading.Lock()
         # セッション初期化を遅延させる（APIリクエスト時に初期化）
         # self._initialize_session()  # この行をコメントアウト
 
@@ -21,42 +203,176 @@ class ChatGPTService:
             if not self.driver.start_session():
                 logger.error("Failed to initialize ChatGPT session")
         except Exception as e:
-            logger.error(f"Error initializing session: {e}")
+            logger.error("Error initializing session: %s", e)
 
     def create_chat_completion(self, request: ChatCompletionRequest) -> Optional[ChatCompletionResponse]:
         """チャット補完を作成（Function Calling対応）"""
+        # レスポンスIDと作成時刻はリクエストごとに一度だけ生成し、各ビルダーへ渡す
+        response_id = generate_id()
+        created = get_current_timestamp()
+        # プロンプトの文字数も一度だけ数え、トークン数の推定に使い回す
+        prompt_chars = _prompt_chars(request.messages)
         try:
             # セッションが無効な場合は再初期化
-            if not self.driver.is_session_active():
-                logger.info("Session inactive, reinitializing...")
-                self._initialize_session()
-                if not self.driver.is_session_active():
-                    logger.error("Failed to reinitialize session")
-                    return None
+            if not self._ensure_session():
+                return None
 
             # Function Calling対応
             if request.functions or request.tools:
-                return self._handle_function_calling(request)
+                return self._handle_function_calling(request, response_id, created, prompt_chars)
 
             # 通常のチャット処理
-            return self._handle_regular_chat(request)
+            return self._handle_regular_chat(request, response_id, created, prompt_chars)
 
         except RuntimeError as e:
             # ログイン関連のエラーをより明確にする
             if "ログイン" in str(e) or "login" in str(e).lower():
-                logger.error(f"Authentication error: {e}")
+                logger.error("Authentication error: %s", e)
                 raise RuntimeError("ChatGPTへのログインが必要です。ブラウザで手動ログインを行ってからAPIを使用してください。")
             elif "応答が見つかりません" in str(e) or "フッター" in str(e):
-                logger.error(f"Response parsing error: {e}")
+                logger.error("Response parsing error: %s", e)
                 raise RuntimeError("ChatGPTの応答を正しく取得できませんでした。ログイン状態を確認してください。")
             else:
-                logger.error(f"Runtime error in chat completion: {e}")
+                logger.error("Runtime error in chat completion: %s", e)
                 raise e
         except Exception as e:
-            logger.error(f"Error creating chat completion: {e}")
+            logger.error("Error creating chat completion: %s", e)
+            return None
+
+    def create_chat_completion_stream(self, request: ChatCompletionRequest) -> Optional[Generator[str, None, None]]:
+        """ストリーミング用のチャット補完を作成（Function Callingなしの通常チャットのみ）
+
+        セッション確認とメッセージ構築はこの呼び出し内で済ませ、失敗時はNoneを返す。
+        ブラウザへの送信は返したイテレータの消費開始時に行い、応答テキストの増分を順に返す。
+        """
+        if not self._ensure_session():
             return None
 
-    def _handle_regular_chat(self, request: ChatCompletionRequest) -> Optional[ChatCompletionResponse]:
+        combined_message = self._build_combined_message(request.messages)
+        if not combined_message:
+            logger.error("No valid message found in request")
+            return None
+
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("Combined message to stream: %s...", combined_message[:200])
+        return self._stream_message(combined_message)
+
+    def _stream_message(self, message: str) -> Generator[str, None, None]:
+        """ChatGPTにメッセージを送信し、応答テキストの増分を返す（送信中はドライバーを占有）"""
+        with self._acquire_driver() as driver:
+            try:
+                yield from driver.send_message_stream(message)
+            except Exception:
+                # 送信に失敗した場合は次のリクエストでセッションを確認し直す
+                self._session_checked_at = 0.0
+                raise
+
+    def _ensure_session(self) -> bool:
+        """セッションが無効な場合は再初期化し、利用可能かどうかを返す"""
+        with self._acquire_driver() as driver:
+            if not self._is_session_active():
+                logger.info("Session inactive, reinitializing...")
+                self._initialize_session()
+                if not driver.is_session_active():
+                    logger.error("Failed to reinitialize session")
+                    return False
+        return True
+
+    @contextmanager
+    def _acquire_driver(self) -> Iterator[ChatGPTDriver]:
+        """ドライバーを排他的に取得する
+
+        SeleniumWrapperはプロセス内で1つのChromeを共有するシングルトンのため、
+        ChatGPTDriverを複数用意しても同じタブを操作することになる。
+        ドライバー操作は必ずここを経由させ、同時に1リクエストだけがブラウザを使うようにする。
+        """
+        with self._driver_lock:
+            yield self.driver
+
+    def _is_session_active(self) -> bool:
+        """セッション有効性を確認（有効と確認できた結果は_SESSION_CHECK_TTL秒間再利用）"""
+        now = time.monotonic()
+        if self._session_checked_at and now - self._session_checked_at < _SESSION_CHECK_TTL:
+            return True
+
+        active = self.driver.is_session_active()
+        self._session_checked_at = now if active else 0.0
+        return active
+
+    def _send_message(self, message: str) -> Optional[str]:
+        """ChatGPTにメッセージを送信（ドライバー操作は同時に1リクエストまで）"""
+        if not (self._response_cache_size or self._coalesce_requests):
+            return self._send_to_driver(message)
+
+        # Function定義を含む送信メッセージ全体をキーにする（完全一致のみ）
+        key = hashlib.blake2b(message.encode("utf-8"), digest_size=16).digest()
+        if self._response_cache_size:
+            cached = self._get_cached_response(key)
+            if cached is not None:
+                logger.info("Response cache hit, skipping browser round-trip")
+                return cached
+
+        if not self._coalesce_requests:
+            response_content = self._send_to_driver(message)
+            if response_content:
+                self._store_cached_response(key, response_content)
+            return response_content
+
+        with self._inflight_lock:
+            future = self._inflight.get(key)
+            is_leader = future is None
+            if is_leader:
+                future = Future()
+                self._inflight[key] = future
+
+        if not is_leader:
+            # 先行リクエストの結果（例外を含む）をそのまま共有する
+            logger.info("Identical request in flight, waiting for its response")
+            return future.result()
+
+        try:
+            response_content = self._send_to_driver(message)
+            if response_content and self._response_cache_size:
+                self._store_cached_response(key, response_content)
+            future.set_result(response_content)
+            return response_content
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._inflight_lock:
+                self._inflight.pop(key, None)
+
+    def _send_to_driver(self, message: str) -> Optional[str]:
+        """ドライバーでメッセージを送信（送信失敗・空応答時はセッションを確認し直す）"""
+        with self._acquire_driver() as driver:
+            try:
+                response_content = driver.send_message(message)
+            except Exception:
+                # 送信に失敗した場合は次のリクエストでセッションを確認し直す
+                self._session_checked_at = 0.0
+                raise
+            if not response_content:
+                self._session_checked_at = 0.0
+        return response_content
+
+    def _get_cached_response(self, key: bytes) -> Optional[str]:
+        """キャッシュ済みの応答本文を取得（参照したエントリは最新扱いにする）"""
+        with self._response_cache_lock:
+            content = self._response_cache.get(key)
+            if content is not None:
+                self._response_cache.move_to_end(key)
+            return content
+
+    def _store_cached_response(self, key: bytes, content: str) -> None:
+        """応答本文をキャッシュに保存（上限を超えたら最も古いエントリを破棄）"""
+        with self._response_cache_lock:
+            self._response_cache[key] = content
+            self._response_cache.move_to_end(key)
+            while len(self._response_cache) > self._response_cache_size:
+                self._response_cache.popitem(last=False)
+
+    def _handle_regular_chat(self, request: ChatCompletionRequest, response_id: str, created: int, prompt_chars: int) -> Optional[ChatCompletionResponse]:
         """通常のチャット処理"""
         # 全メッセージを処理（systemメッセージも含む）
         combined_message = self._build_combined_message(request.messages)
@@ -64,46 +380,45 @@ class ChatGPTService:
             logger.error("No valid message found in request")
             return None
 
-        logger.info(f"Combined message to send: {combined_message[:200]}...")
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("Combined message to send: %s...", combined_message[:200])
 
         # ChatGPTにメッセージを送信
-        response_content = self.driver.send_message(combined_message)
+        response_content = self._send_message(combined_message)
         if not response_content:
             logger.error("Failed to get response from ChatGPT")
             return None
 
         # レスポンスの詳細ログ（デバッグ用）
-        logger.info(f"Raw ChatGPT response length: {len(response_content)} characters")
-        logger.info(f"Raw ChatGPT response preview: {response_content[:200]}...")
-        if len(response_content) > 200:
-            logger.info(f"Raw ChatGPT response ending: ...{response_content[-100:]}")
+        # INFOが無効な本番環境ではプレビュー用のスライスも作らない
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("Raw ChatGPT response length: %d characters", len(response_content))
+            logger.info("Raw ChatGPT response preview: %s...", response_content[:200])
+            if len(response_content) > 200:
+                logger.info("Raw ChatGPT response ending: ...%s", response_content[-100:])
 
         # "I am thinking" メッセージの検出と完全除去（強化版）
-        thinking_patterns = [
-            "I am thinking about how to help you",
-            "I'm thinking about how to help you",
-            "Let me think about how to help you"
-        ]
-
-        for pattern in thinking_patterns:
-            if pattern in response_content:
-                logger.warning(f"Detected thinking message pattern: {pattern}")
-                # パターンを完全に除去
-                import re
-                cleaned_response = re.sub(re.escape(pattern) + r"[.\s]*", "", response_content, flags=re.IGNORECASE)
-                if cleaned_response.strip():
-                    response_content = cleaned_response.strip()
-                    logger.info(f"Cleaned response: {response_content}")
-                else:
-                    # フィルタリング後に内容がない場合は再試行
-                    logger.error(f"No content remaining after filtering '{pattern}' message - possible incomplete response")
-                    return None
+        # 大半の応答には含まれないため、まず部分文字列チェックで絞り込んでから正規表現を使う
+        # 検出と除去はsubnの1回の走査で行い、置換数で検出有無を判断する
+        if "think" in response_content.lower():
+            cleaned_response, removed = _THINKING_RE.subn("", response_content)
+        else:
+            removed = 0
+        if removed:
+            logger.warning("Detected thinking message pattern (%d occurrence(s))", removed)
+            if cleaned_response.strip():
+                response_content = cleaned_response.strip()
+                logger.info("Cleaned response: %s", response_content)
+            else:
+                # フィルタリング後に内容がない場合は再試行
+                logger.error("No content remaining after filtering thinking message - possible incomplete response")
+                return None
 
         # レスポンスを構築
-        response = self._build_response(request, response_content)
+        response = self._build_response(request, response_content, response_id, created, prompt_chars)
         return response
 
-    def _handle_function_calling(self, request: ChatCompletionRequest) -> Optional[ChatCompletionResponse]:
+    def _handle_function_calling(self, request: ChatCompletionRequest, response_id: str, created: int, prompt_chars: int) -> Optional[ChatCompletionResponse]:
         """Function Calling処理"""
         try:
             # Function定義をChatGPTに送信
@@ -118,16 +433,17 @@ class ChatGPTService:
             # Function定義付きでメッセージを構築
             enhanced_message = self._build_function_message(combined_message, function_context)
 
-            logger.info(f"Enhanced Function Calling message: {enhanced_message[:300]}...")
+            if logger.isEnabledFor(logging.INFO):
+                logger.info("Enhanced Function Calling message: %s...", enhanced_message[:300])
 
             # ChatGPTに送信
-            response_content = self.driver.send_message(enhanced_message)
+            response_content = self._send_message(enhanced_message)
             if not response_content:
                 logger.error("Failed to get response from ChatGPT")
                 # Function Calling失敗時は通常のエラーレスポンスを返す
-                return self._build_error_response(request, "Failed to process function calling request")
+                return self._build_error_response(request, "Failed to process function calling request", response_id, created, prompt_chars)
 
-            logger.info(f"Function Calling raw response: {response_content}")
+            logger.info("Function Calling raw response: %s", response_content)
 
             # Function Call検出用の関数リストを取得
             functions = request.functions or self._extract_functions_from_tools(request.tools)
@@ -138,45 +454,45 @@ class ChatGPTService:
             if function_call:
                 # Tools APIの場合はTool Callsレスポンス、Function APIの場合はFunction Callレスポンス
                 if request.tools:
-                    return self._build_tool_call_response(request, function_call, response_content)
+                    return self._build_tool_call_response(request, function_call, response_content, response_id, created, prompt_chars)
                 else:
-                    return self._build_function_call_response(request, function_call, response_content)
+                    return self._build_function_call_response(request, function_call, response_content, response_id, created, prompt_chars)
             else:
                 # Function Callが検出されない場合、通常のレスポンスとして返す
                 logger.info("No function call detected, returning regular response")
-                return self._build_response(request, response_content)
+                return self._build_response(request, response_content, response_id, created, prompt_chars)
 
         except Exception as e:
-            logger.error(f"Error handling function calling: {e}")
-            return self._build_error_response(request, f"Function calling error: {str(e)}")
+            logger.error("Error handling function calling: %s", e)
+            return self._build_error_response(request, f"Function calling error: {str(e)}", response_id, created, prompt_chars)
 
-    def _build_error_response(self, request: ChatCompletionRequest, error_message: str) -> ChatCompletionResponse:
+    def _build_error_response(self, request: ChatCompletionRequest, error_message: str, response_id: str, created: int, prompt_chars: int) -> ChatCompletionResponse:
         """エラーレスポンスを構築"""
-        from models import ChatMessage, ChatCompletionChoice
-
         # エラーメッセージを作成
-        message = ChatMessage(
+        # 値はすべてサービス内部で生成したものなので、検証を省略してmodel_constructで組み立てる
+        message = ChatMessage.model_construct(
             role="assistant",
             content=f"I apologize, but I encountered an error while processing your request: {error_message}"
         )
 
-        choice = ChatCompletionChoice(
+        choice = ChatCompletionChoice.model_construct(
             index=0,
             message=message,
             finish_reason="stop"
         )
 
         # 使用量を推定
-        usage = ChatCompletionUsage(
-            prompt_tokens=len(' '.join(msg.content or '' for msg in request.messages)) // 4,
-            completion_tokens=len(error_message) // 4,
-            total_tokens=0
+        prompt_tokens = prompt_chars // 4
+        completion_tokens = len(error_message) // 4
+        usage = ChatCompletionUsage.model_construct(
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            total_tokens=prompt_tokens + completion_tokens
         )
-        usage.total_tokens = usage.prompt_tokens + usage.completion_tokens
 
-        response = ChatCompletionResponse(
-            id=generate_id(),
-            created=get_current_timestamp(),
+        response = ChatCompletionResponse.model_construct(
+            id=response_id,
+            created=created,
             model=request.model,
             choices=[choice],
             usage=usage
@@ -185,38 +501,17 @@ class ChatGPTService:
         return response
 
     def _build_function_context(self, request: ChatCompletionRequest) -> str:
-        """Function定義のコンテキストを構築"""
+        """Function定義のコンテキストを構築（同一定義セットはレンダリング結果を再利用）"""
         functions = request.functions or self._extract_functions_from_tools(request.tools)
         if not functions:
             return ""
 
-        # より自然なプロンプトエンジニアリングを使用
-        context = "I have access to the following functions that I can call to help answer your question:\n\n"
-
-        for func in functions:
-            context += f"Function: {func.name}\n"
-            context += f"Description: {func.description}\n"
-
-            # パラメータをわかりやすく説明
-            if hasattr(func, 'parameters') and func.parameters:
-                params = func.parameters.get('properties', {})
-                required = func.parameters.get('required', [])
-
-                context += "Parameters:\n"
-                for param_name, param_info in params.items():
-                    param_type = param_info.get('type', 'string')
-                    param_desc = param_info.get('description', '')
-                    is_required = param_name in required
-                    req_text = " (required)" if is_required else " (optional)"
-                    context += f"  - {param_name} ({param_type}){req_text}: {param_desc}\n"
-
-            context += "\n"
-
-        context += "When you need to call a function, please respond with a JSON object in this exact format:\n"
-        context += '{"function_call": {"name": "function_name", "arguments": "{\\"parameter\\": \\"value\\"}"}}\n\n'
-        context += "Make sure to use proper JSON formatting with escaped quotes in the arguments.\n\n"
-
-        return context
+        # 出力はname・description・parametersだけで決まるため、それをキーにする
+        functions_key = tuple(
+            (func.name, func.description, json.dumps(func.parameters, ensure_ascii=False))
+            for func in functions
+        )
+        return _render_function_context(functions_key)
 
     def _extract_functions_from_tools(self, tools: Optional[List]) -> List:
         """Tools形式からFunction定義を抽出"""
@@ -230,138 +525,116 @@ class ChatGPTService:
 
     def _detect_function_call(self, response_content: str, functions: List) -> Optional[dict]:
         """レスポンスからFunction Callを検出（Action形式対応強化版）"""
-        import json
-        import re
+        # 大半の応答はどちらの形式も含まないため、部分文字列チェックで先に除外する
+        # （Action形式の正規表現は大文字小文字を区別しないので小文字化して確認）
+        has_action = "action:" in response_content.lower()
+        has_function_call = '"function_call"' in response_content
+        if not (has_action or has_function_call):
+            return None
 
-        # パターン1: Action: {...} 形式の検出（優先）
-        action_pattern = r'Action:\s*\{[^}]*"action"\s*:\s*"([^"]+)"[^}]*"action_input"\s*:\s*(\{[^}]*\}|"[^"]*")[^}]*\}'
-        action_matches = re.findall(action_pattern, response_content, re.DOTALL | re.IGNORECASE)
-        
-        for match in action_matches:
-            try:
-                action_name = match[0].strip()
-                action_input = match[1].strip()
-                
-                # action_inputがJSON文字列の場合は解析
-                if action_input.startswith('{'):
-                    try:
-                        action_input_dict = json.loads(action_input)
-                        action_arguments = json.dumps(action_input_dict, ensure_ascii=False)
-                    except json.JSONDecodeError:
+        # 候補ごとの関数名チェックをO(1)にするため、定義済み関数名の集合を先に作る
+        func_names = {f.name for f in functions}
+
+        if has_action:
+            # パターン1: Action: {...} 形式（優先）とパターン2: Action: function_name 形式を1回の走査で検出
+            # Action: {...} 形式が見つかればその場で返し、シンプル形式は最初の候補だけ覚えておいて最後に使う
+            simple_action_name = None
+
+            for match in _ACTION_DISPATCH_RE.finditer(response_content):
+                if match.lastgroup == "action_simple":
+                    if simple_action_name is None and match.group("s_name") in func_names:
+                        simple_action_name = match.group("s_name")
+                    continue
+
+                try:
+                    action_name = match.group("a_name").strip()
+                    action_input = match.group("a_input").strip()
+
+                    # action_inputがJSONオブジェクトの場合はそのまま使う
+                    # （妥当なJSONならloads→dumpsで整形し直す必要はなく、元の表記を保つ）
+                    if action_input.startswith('{'):
+                        action_arguments = action_input
+                    elif action_input.startswith('"') and action_input.endswith('"'):
+                        # 文字列の場合はそのまま使用（クォートを除去）
+                        action_arguments = action_input[1:-1]
+                    else:
                         action_arguments = action_input
-                elif action_input.startswith('"') and action_input.endswith('"'):
-                    # 文字列の場合はそのまま使用（クォートを除去）
-                    action_arguments = action_input[1:-1]
-                else:
-                    action_arguments = action_input
-                
-                # 関数名が定義済み関数に含まれているかチェック
-                if any(f.name == action_name for f in functions):
-                    logger.info(f"Detected Action format function call: {action_name}")
-                    return {
-                        "name": action_name,
-                        "arguments": action_arguments
-                    }
-                    
-            except Exception as e:
-                logger.debug(f"Error parsing Action format: {e}")
-                continue
 
-        # パターン2: より柔軟なAction形式（シンプル版）
-        simple_action_pattern = r'Action:\s*([a-zA-Z_][a-zA-Z0-9_]*)'
-        simple_matches = re.findall(simple_action_pattern, response_content, re.IGNORECASE)
-        
-        for action_name in simple_matches:
-            if any(f.name == action_name for f in functions):
-                logger.info(f"Detected simple Action format function call: {action_name}")
+                    # 関数名が定義済み関数に含まれているかチェック
+                    if action_name in func_names:
+                        logger.info("Detected Action format function call: %s", action_name)
+                        return {
+                            "name": action_name,
+                            "arguments": action_arguments
+                        }
+
+                except Exception as e:
+                    logger.debug("Error parsing Action format: %s", e)
+                    continue
+
+            if simple_action_name is not None:
+                action_name = simple_action_name
+                logger.info("Detected simple Action format function call: %s", action_name)
                 # 引数を推測して抽出（次の行やJSON部分から）
-                args_pattern = r'Action:\s*' + re.escape(action_name) + r'[^\{]*(\{[^}]*\})'
-                args_match = re.search(args_pattern, response_content, re.DOTALL | re.IGNORECASE)
-                
+                args_match = _action_args_re(action_name).search(response_content)
+
                 if args_match:
                     try:
-                        arguments = json.loads(args_match.group(1))
+                        # 妥当なJSONであることだけ確認し、再シリアライズせずに元の文字列を使う
+                        json.loads(args_match.group(1))
                         return {
                             "name": action_name,
-                            "arguments": json.dumps(arguments, ensure_ascii=False)
+                            "arguments": args_match.group(1)
                         }
                     except json.JSONDecodeError:
                         pass
-                
+
                 # 引数が見つからない場合は空のオブジェクト
                 return {
                     "name": action_name,
                     "arguments": "{}"
                 }
 
-        # パターン3: JSON形式のfunction_callを検索（ネストしたJSONにも対応）
-        # パターン3-1: {"function_call": ...} の形式
-        pattern1 = r'\{[^}]*"function_call"[^}]*"name"[^}]*"arguments"[^}]*\}'
-        matches = re.findall(pattern1, response_content, re.DOTALL)
-
-        for match in matches:
-            try:
-                parsed = json.loads(match)
-                if "function_call" in parsed:
+        if has_function_call:
+            # パターン3: JSON形式のfunction_callを検索（ネストしたJSONにも対応）
+            # パターン3-1: {"function_call": ...} の形式
+            # 各 '{' の位置から raw_decode で直接解析する（括弧の対応付けもデコーダに任せる）
+            start = response_content.find('{')
+            while start != -1:
+                try:
+                    parsed, end = _JSON_DECODER.raw_decode(response_content, start)
+                except json.JSONDecodeError:
+                    # 閉じていない括弧・不正なJSON。内側に完結したオブジェクトがある可能性があるので次の '{' から再開
+                    start = response_content.find('{', start + 1)
+                    continue
+
+                if isinstance(parsed, dict) and isinstance(parsed.get("function_call"), dict):
                     func_call = parsed["function_call"]
                     # 関数名が定義済み関数に含まれているかチェック
-                    if any(f.name == func_call.get("name") for f in functions):
-                        return func_call
-            except json.JSONDecodeError:
-                continue
-
-        # パターン3-2: より複雑なJSON構造に対応
-        try:
-            # 全体をJSONとして解析を試行
-            lines = response_content.strip().split('\n')
-            for line in lines:
-                line = line.strip()
-                if line.startswith('{') and 'function_call' in line:
-                    try:
-                        parsed = json.loads(line)
-                        if "function_call" in parsed:
-                            func_call = parsed["function_call"]
-                            if any(f.name == func_call.get("name") for f in functions):
-                                return func_call
-                    except json.JSONDecodeError:
-                        continue
-        except Exception:
-            pass
+                    if isinstance(func_call.get("name"), str) and func_call["name"] in func_names:
+                        return _normalize_function_call(func_call)
+                start = response_content.find('{', end)
 
         return None
 
-    def _build_function_call_response(self, request: ChatCompletionRequest, function_call: dict, response_content: str) -> ChatCompletionResponse:
+    def _build_function_call_response(self, request: ChatCompletionRequest, function_call: dict, response_content: str, response_id: str, created: int, prompt_chars: int) -> ChatCompletionResponse:
         """Function Callレスポンスを構築（Action形式対応強化版）"""
-        from models import ChatMessage, ChatCompletionChoice, FunctionCall
-
         # Action形式の場合、適切なContentも含める
-        action_detected = "Action:" in response_content
-        
-        # レスポンス内容の処理
-        if action_detected:
-            # Action形式の場合、Actionより前の部分をcontentとして保持
-            import re
-            action_pattern = r'(.*?)Action:\s*\{[^}]*\}'
-            match = re.search(action_pattern, response_content, re.DOTALL | re.IGNORECASE)
-            content_before_action = match.group(1).strip() if match else None
-            
-            # 空でない場合のみcontentを設定
-            message_content = content_before_action if content_before_action else None
-        else:
-            # 通常のfunction_call形式の場合はcontentをnullに設定
-            message_content = None
+        # （Actionより前の部分をcontentとして保持し、通常のfunction_call形式ではnullにする）
+        action_detected, message_content = _extract_pre_action(response_content)
 
         # Function Callメッセージを作成
-        message = ChatMessage(
+        # （function_callは_detect_function_callが name/arguments とも文字列に揃えて返すため検証を省略）
+        message = ChatMessage.model_construct(
             role="assistant",
             content=message_content,
-            function_call=FunctionCall(
+            function_call=FunctionCall.model_construct(
                 name=function_call["name"],
                 arguments=function_call["arguments"]
             )
         )
 
-        choice = ChatCompletionChoice(
+        choice = ChatCompletionChoice.model_construct(
             index=0,
             message=message,
             finish_reason="function_call"
@@ -369,67 +642,54 @@ class ChatGPTService:
 
         # 使用量を推定
         # 基本的な使用量推定
-        usage = ChatCompletionUsage(
-            prompt_tokens=len(' '.join(msg.content or '' for msg in request.messages)) // 4,
-            completion_tokens=len(response_content) // 4,
-            total_tokens=0
+        prompt_tokens = prompt_chars // 4
+        completion_tokens = len(response_content) // 4
+        usage = ChatCompletionUsage.model_construct(
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            total_tokens=prompt_tokens + completion_tokens
         )
-        usage.total_tokens = usage.prompt_tokens + usage.completion_tokens
 
-        response = ChatCompletionResponse(
-            id=generate_id(),
-            created=get_current_timestamp(),
+        response = ChatCompletionResponse.model_construct(
+            id=response_id,
+            created=created,
             model=request.model,
             choices=[choice],
             usage=usage
         )
 
-        logger.info(f"Built Function Call response for {function_call['name']} (Action format: {action_detected})")
+        logger.info("Built Function Call response for %s (Action format: %s)", function_call["name"], action_detected)
         return response
 
-    def _build_tool_call_response(self, request: ChatCompletionRequest, function_call: dict, response_content: str) -> ChatCompletionResponse:
+    def _build_tool_call_response(self, request: ChatCompletionRequest, function_call: dict, response_content: str, response_id: str, created: int, prompt_chars: int) -> ChatCompletionResponse:
         """Tool Call レスポンスを構築（Action形式対応強化版）"""
-        from models import ChatMessage, ChatCompletionChoice, ToolCall, FunctionCall
-        from utils import generate_id
 
         # Action形式の場合、適切なContentも含める
-        action_detected = "Action:" in response_content
-        
-        # レスポンス内容の処理
-        if action_detected:
-            # Action形式の場合、Actionより前の部分をcontentとして保持
-            import re
-            action_pattern = r'(.*?)Action:\s*\{[^}]*\}'
-            match = re.search(action_pattern, response_content, re.DOTALL | re.IGNORECASE)
-            content_before_action = match.group(1).strip() if match else None
-            
-            # 空でない場合のみcontentを設定
-            message_content = content_before_action if content_before_action else None
-        else:
-            # 通常のtool_call形式の場合はcontentをnullに設定
-            message_content = None
+        # （Actionより前の部分をcontentとして保持し、通常のtool_call形式ではnullにする）
+        action_detected, message_content = _extract_pre_action(response_content)
 
         # Tool Call IDを生成
         tool_call_id = generate_id("call")
 
         # Tool Call オブジェクトを作成
-        tool_call = ToolCall(
+        # （function_callは_detect_function_callが name/arguments とも文字列に揃えて返すため検証を省略）
+        tool_call = ToolCall.model_construct(
             id=tool_call_id,
             type="function",
-            function=FunctionCall(
+            function=FunctionCall.model_construct(
                 name=function_call["name"],
                 arguments=function_call["arguments"]
             )
         )
 
         # Tool Call メッセージを作成
-        message = ChatMessage(
+        message = ChatMessage.model_construct(
             role="assistant",
             content=message_content,
             tool_calls=[tool_call]
         )
 
-        choice = ChatCompletionChoice(
+        choice = ChatCompletionChoice.model_construct(
             index=0,
             message=message,
             finish_reason="tool_calls"
@@ -437,22 +697,23 @@ class ChatGPTService:
 
         # 使用量を推定
         # 基本的な使用量推定
-        usage = ChatCompletionUsage(
-            prompt_tokens=len(' '.join(msg.content or '' for msg in request.messages)) // 4,
-            completion_tokens=len(response_content) // 4,
-            total_tokens=0
+        prompt_tokens = prompt_chars // 4
+        completion_tokens = len(response_content) // 4
+        usage = ChatCompletionUsage.model_construct(
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            total_tokens=prompt_tokens + completion_tokens
         )
-        usage.total_tokens = usage.prompt_tokens + usage.completion_tokens
 
-        response = ChatCompletionResponse(
-            id=generate_id(),
-            created=get_current_timestamp(),
+        response = ChatCompletionResponse.model_construct(
+            id=response_id,
+            created=created,
             model=request.model,
             choices=[choice],
             usage=usage
         )
 
-        logger.info(f"Built Tool Call response for {function_call['name']} (Action format: {action_detected})")
+        logger.info("Built Tool Call response for %s (Action format: %s)", function_call["name"], action_detected)
         return response
 
     def _get_latest_user_message(self, messages: List[ChatMessage]) -> Optional[ChatMessage]:
@@ -464,74 +725,68 @@ class ChatGPTService:
 
     def _build_combined_message(self, messages: List[ChatMessage]) -> str:
         """システムメッセージとユーザーメッセージを組み合わせた文字列を構築（分離防止強化版）"""
+        # 1回の走査でシステムメッセージと最新のユーザーメッセージだけを拾う
+        # （assistantメッセージは送信内容に含めないため集めない）
         system_messages = []
-        user_messages = []
-        assistant_messages = []
+        latest_user_message = None
 
         for message in messages:
-            if message.role == "system" and message.content:
-                system_messages.append(message.content)
-            elif message.role == "user" and message.content:
-                user_messages.append(message.content)
-            elif message.role == "assistant" and message.content:
-                assistant_messages.append(message.content)
+            content = message.content
+            if not content:
+                continue
+            if message.role == "system":
+                system_messages.append(content)
+            elif message.role == "user":
+                latest_user_message = content
 
         # メッセージを組み合わせ（システムメッセージ分離防止強化）
-        combined_parts = []
-
-        # システムプロンプトがある場合は適切に統合
-        if system_messages and user_messages:
+        # 結果は常に1つの文字列なので、中間リストを経由せず直接組み立てる
+        if system_messages and latest_user_message is not None:
             # システムメッセージとユーザーメッセージを密接に統合
             system_content = " ".join(system_messages)
-            latest_user_message = user_messages[-1]
             
             # 分離しにくい形式で統合（改行ではなくスペースで区切り、文脈を連続させる）
-            integrated_message = f"{system_content} Please respond to this user request: {latest_user_message}"
-            combined_parts.append(integrated_message)
+            combined_message = f"{system_content} Please respond to this user request: {latest_user_message}"
             
-            logger.info(f"Built integrated message to prevent system message separation: {len(system_content)} sys chars + {len(latest_user_message)} user chars")
+            logger.info("Built integrated message to prevent system message separation: %d sys chars + %d user chars", len(system_content), len(latest_user_message))
             
         elif system_messages:
             # システムメッセージのみの場合
-            combined_parts.append(" ".join(system_messages))
-        elif user_messages:
+            combined_message = " ".join(system_messages)
+        elif latest_user_message is not None:
             # ユーザーメッセージのみの場合
-            latest_user_message = user_messages[-1]
-            combined_parts.append(f"User: {latest_user_message}")
-
-        if not combined_parts:
+            combined_message = f"User: {latest_user_message}"
+        else:
             return ""
 
-        # 単一の統合されたメッセージとして返す
-        combined_message = " ".join(combined_parts)
-        
         # 分離リスクの警告
         if len(combined_message) > 4000:
-            logger.warning(f"Combined message is {len(combined_message)} chars - may trigger chunking and potential system message separation")
+            logger.warning("Combined message is %d chars - may trigger chunking and potential system message separation", len(combined_message))
         
         return combined_message
 
-    def _build_response(self, request: ChatCompletionRequest, content: str) -> ChatCompletionResponse:
+    def _build_response(self, request: ChatCompletionRequest, content: str, response_id: str, created: int, prompt_chars: int) -> ChatCompletionResponse:
         """レスポンスオブジェクトを構築"""
         # 使用量を推定（実際の値は取得困難なため概算）
-        prompt_tokens = self._estimate_tokens(request.messages)
-        completion_tokens = self._estimate_tokens([ChatMessage(role="assistant", content=content)])
+        prompt_tokens = max(1, prompt_chars // 4)
+        completion_tokens = max(1, len(content) // 4)
 
-        choice = ChatCompletionChoice(
+        # 値はすべてサービス内部で生成したものなので、検証を省略してmodel_constructで組み立てる
+        choice = ChatCompletionChoice.model_construct(
             index=0,
-            message=ChatMessage(role="assistant", content=content),
+            message=ChatMessage.model_construct(role="assistant", content=content),
             finish_reason="stop"
         )
 
-        usage = ChatCompletionUsage(
+        usage = ChatCompletionUsage.model_construct(
             prompt_tokens=prompt_tokens,
             completion_tokens=completion_tokens,
             total_tokens=prompt_tokens + completion_tokens
         )
 
-        return ChatCompletionResponse(
-            id=generate_id(),
-            created=get_current_timestamp(),
+        return ChatCompletionResponse.model_construct(
+            id=response_id,
+            created=created,
             model=request.model,
             choices=[choice],
             usage=usage
@@ -539,9 +794,8 @@ class ChatGPTService:
 
     def _estimate_tokens(self, messages: List[ChatMessage]) -> int:
         """トークン数を推定（簡易版）"""
-        total_chars = sum(len(msg.content or '') for msg in messages)
         # 英語の場合、約4文字で1トークンと仮定
-        return max(1, total_chars // 4)
+        return max(1, _prompt_chars(messages) // 4)
 
     def health_check(self) -> bool:
         """ヘルスチェック"""
@@ -0,0 +1,59 @@
+"""
+テスト共通フィクスチャ
+"""
+
+import pytest
+from unittest.mock import create_autospec
+
+try:
+    import pytest_asyncio
+except ImportError:  # 基本テストだけを実行する環境ではpytest-asyncioがなくてもよい
+    pytest_asyncio = None
+
+
+@pytest.fixture(scope="session")
+def client():
+    """テストセッション全体で共有するテストクライアント
+
+    lifespanを起動するとブラウザ起動・終了処理が走るため、コンテキストマネージャとしては使わない。
+    """
+    # アプリ全体のインポートは収集時ではなく、APIテストで初めて必要になった時点で行う
+    from fastapi.testclient import TestClient
+    from main import app
+    return TestClient(app)
+
+
+@pytest.fixture(scope="session")
+def _service_template():
+    """ChatGPTServiceの仕様に合わせたモック（仕様の読み取りはセッションで1回だけ）"""
+    from services import ChatGPTService
+    return create_autospec(ChatGPTService, instance=True)
+
+
+@pytest.fixture
+def mock_service(_service_template):
+    """APIが使うChatGPTServiceをモックに差し替える
+
+    エンドポイントに注入される依存関係をapp.dependency_overridesで置き換える。
+    モックはセッションで使い回し、テスト終了時に呼び出し履歴・戻り値・side_effectを初期化する。
+    """
+    from api import get_chatgpt_service
+    from main import app
+    app.dependency_overrides[get_chatgpt_service] = lambda: _service_template
+    yield _service_template
+    app.dependency_overrides.pop(get_chatgpt_service, None)
+    _service_template.reset_mock(return_value=True, side_effect=True)
+
+
+if pytest_asyncio is not None:
+    @pytest_asyncio.fixture(scope="session", loop_scope="session")
+    async def async_client():
+        """テストセッション全体で共有する非同期テストクライアント（イベントループも共有）
+
+        ASGIアプリをhttpx経由でインメモリのまま直接呼び出し、TestClientのようなリクエストごとのスレッド往復を避ける。
+        ASGITransportはlifespanを起動しないため、ブラウザは起動しない。
+        """
+        import httpx
+        from main import app
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as c:
+            yield c
@@ -7,34 +7,134 @@
 import sys
 import os
 import subprocess
-import importlib.util
+from collections import deque
+from importlib.metadata import distributions, entry_points
 
 # プロジェクトルートをパスに追加
 project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.insert(0, project_root)
 
+# 1を設定すると従来どおり別プロセスでテストを実行する（CIでの分離用）
+USE_SUBPROCESS = os.environ.get("CHGPT_TEST_SUBPROCESS") == "1"
+
+# CI（CI=true）では成功時のテストごとの出力を省き、失敗時だけ末尾の出力を表示する
+QUIET = os.environ.get("CI") == "true"
+QUIET_TAIL_LINES = 200
+
+
+def installed_distributions():
+    """インストール済みディストリビューション名の集合（小文字・アンダースコア区切りに正規化）"""
+    names = set()
+    for dist in distributions():
+        name = dist.metadata["Name"]
+        if name:
+            names.add(name.lower().replace("-", "_"))
+    return names
 
-def check_dependency(module_name):
-    """依存関係の存在確認"""
-    spec = importlib.util.find_spec(module_name)
-    return spec is not None
 
+# メタデータの読み込みは起動時の1回だけにし、以降の確認は集合の照合で済ませる
+# （find_specと違い、確認のためにパッケージのコードを実行することもない）
+_INSTALLED_DISTS = installed_distributions()
 
-def run_basic_tests():
-    """基本テスト実行（外部依存なし）"""
-    print("=== Running Basic Tests (No Dependencies Required) ===")
 
-    try:
-        # 基本テストを実行
-        result = subprocess.run([
-            sys.executable, "-m", "tests.test_basic"
-        ], capture_output=True, text=True, cwd=project_root)
+def check_dependency(dist_name):
+    """依存関係（ディストリビューション名で指定）がインストールされているかを返す"""
+    return dist_name.lower().replace("-", "_") in _INSTALLED_DISTS
+
+
+# このテストスイートでは使わないpytestプラグイン（インストールされていれば読み込みを止める）
+# ※ asyncio（pytest-asyncio）とxdistはテストで使うため含めない
+UNUSED_PLUGINS = ("anyio", "pytest_cov", "html", "metadata", "pytest_mock")
+
+
+def _disabled_plugin_args():
+    """インストール済みプラグインのうち不要なものを無効化する引数を返す"""
+    installed = {ep.name for ep in entry_points(group="pytest11")}
+    args = []
+    for name in UNUSED_PLUGINS:
+        if name in installed:
+            args += ["-p", f"no:{name}"]
+    return args
+
+
+# キャッシュ書き込み・不要プラグインを省き、sys.pathを書き換えないimportlibモードで収集する
+# （プラグインの確認はモジュール読み込み時に1回だけ行い、以降は固定の引数を使い回す）
+PYTEST_ARGS = (
+    "-v",
+    "-p", "no:cacheprovider",
+    "-p", "no:stepwise",
+    *_disabled_plugin_args(),
+    "--no-header",
+    "-o", "console_output_style=count",
+    "--import-mode=importlib",
+)
+
+
+def parallel_args():
+    """pytest-xdistがあれば並列実行する引数を返す（なければ直列）
+
+    テストは個別に各ワーカーへ振り分け、xdist_groupマーカーの付いたテスト
+    （SeleniumWrapperを差し替えるドライバーテストなど）は同じワーカーでまとめて実行する。
+    """
+    if not check_dependency('pytest-xdist'):
+        print("pytest-xdist not found, running tests serially")
+        return []
+
+    workers = "auto"
+    if os.environ.get("VSCODE_PID") or os.environ.get("TERM_PROGRAM"):
+        # IDEなどと同時に動かす場合は2コア分を残す
+        workers = str(max(1, (os.cpu_count() or 1) - 2))
+    return ["-n", workers, "--dist=loadgroup"]
+
+
+def run_in_subprocess(args):
+    """別プロセスのPythonでモジュールを実行し、成否を返す"""
+    # 出力を溜め込まず、標準エラーもまとめて1行ずつそのまま流す
+    # （QUIETの場合は直近の行だけを保持し、失敗したときにまとめて表示する）
+    tail = deque(maxlen=QUIET_TAIL_LINES) if QUIET else None
+    with subprocess.Popen(
+        [sys.executable, "-m"] + args,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+        bufsize=1,
+        cwd=project_root
+    ) as process:
+        for line in process.stdout:
+            if tail is not None:
+                tail.append(line)
+            else:
+                sys.stdout.write(line)
+        returncode = process.wait()
+
+    if returncode != 0 and tail:
+        sys.stdout.writelines(tail)
+
+    return returncode == 0
 
-        print(result.stdout)
-        if result.stderr:
-            print("STDERR:", result.stderr)
 
-        return result.returncode == 0
+def run_pytest(args):
+    """pytestを実行し、成否を返す（CHGPT_TEST_SUBPROCESS=1なら別プロセスで実行）"""
+    if QUIET:
+        # -vを打ち消して進捗表示と失敗の要約だけにする
+        args = args + ["-q"]
+
+    if USE_SUBPROCESS:
+        return run_in_subprocess(["pytest"] + args)
+
+    import pytest
+    return pytest.main(args) == 0
+
+
+def run_basic_tests():
+    """基本テスト実行（外部依存なし）
+
+    test_basic.py のうち basic マーカー付きのテストだけをpytestで実行する。
+    """
+    print("\n=== Running Basic Tests (No Dependencies Required) ===")
+
+    try:
+        return run_pytest([os.path.join(project_root, "tests", "test_basic.py"), "-m", "basic", *PYTEST_ARGS])
 
     except Exception as e:
         print(f"Error running basic tests: {e}")
@@ -42,7 +142,12 @@ def run_basic_tests():
 
 
 def run_full_tests():
-    """フルテスト実行（依存関係必要）"""
+    """フルテスト実行（依存関係必要）
+
+    Returns:
+        (成否, 不足している依存関係のリスト) のタプル。
+        依存関係が不足している場合はテストを実行せずに (False, 不足分) を返す。
+    """
     print("\n=== Checking Dependencies ===")
 
     # 必要な依存関係をチェック
@@ -54,35 +159,24 @@ def run_full_tests():
         'uvicorn'
     ]
 
-    missing_deps = []
-    for dep in dependencies:
-        if not check_dependency(dep):
-            missing_deps.append(dep)
+    missing_deps = [dep for dep in dependencies if not check_dependency(dep)]
 
     if missing_deps:
         print(f"Missing dependencies: {missing_deps}")
         print("Please install with: pip install -r requirements.txt")
-        return False
+        return False, missing_deps
 
     print("All dependencies found!")
 
     print("\n=== Running Full Test Suite ===")
 
     try:
-        # pytestを使用してフルテスト実行
-        result = subprocess.run([
-            sys.executable, "-m", "pytest", "tests/", "-v"
-        ], capture_output=True, text=True, cwd=project_root)
-
-        print(result.stdout)
-        if result.stderr:
-            print("STDERR:", result.stderr)
-
-        return result.returncode == 0
+        # pytestを使用してフルテスト実行（basicマーカーのテストも含む）
+        return run_pytest([os.path.join(project_root, "tests"), *PYTEST_ARGS, *parallel_args()]), []
 
     except Exception as e:
         print(f"Error running full tests: {e}")
-        return False
+        return False, []
 
 
 def run_smoke_test():
@@ -95,10 +189,11 @@ def run_smoke_test():
         from utils import generate_id, sanitize_message
 
         # 基本機能テスト
-        message = ChatMessage(role="user", content="Test")
+        # （バリデーションはTestModelsで確認するため、ここでは検証を省いて組み立てる）
+        message = ChatMessage.model_construct(role="user", content="Test")
         assert message.role == "user"
 
-        request = ChatCompletionRequest(
+        request = ChatCompletionRequest.model_construct(
             model="gpt-3.5-turbo",
             messages=[message]
         )
@@ -125,24 +220,29 @@ def main():
     print("=" * 50)
 
     success_count = 0
-    total_tests = 3
+    total_tests = 2
 
     # 1. スモークテスト
     if run_smoke_test():
         success_count += 1
 
-    # 2. 基本テスト
-    if run_basic_tests():
-        success_count += 1
-
-    # 3. フルテスト（依存関係がある場合のみ）
-    if check_dependency('fastapi') and check_dependency('pytest'):
-        if run_full_tests():
+    # 2. pytestによるテスト
+    # 依存関係がそろっていればフルテスト（基本テストを含む）を1回だけ実行し、
+    # そろっていなければbasicマーカーのテストだけを実行する
+    # （依存関係の確認はrun_full_tests内の1回だけで、その結果を使い回す）
+    full_success, missing_deps = run_full_tests()
+    if not missing_deps:
+        if full_success:
             success_count += 1
+    elif 'pytest' in missing_deps:
+        print("\n=== Skipping Tests (pytest Not Available) ===")
+        print("Install dependencies with: pip install -r requirements.txt")
+        total_tests = 1
     else:
         print("\n=== Skipping Full Tests (Dependencies Not Available) ===")
         print("Install dependencies with: pip install -r requirements.txt")
-        total_tests = 2  # フルテストはスキップ
+        if run_basic_tests():
+            success_count += 1
 
     # 結果サマリー
     print("\n" + "=" * 50)
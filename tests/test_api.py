@@ -1,80 +1,354 @@
+import json
+import logging
+import re
+import threading
 import time
 import pytest
 import asyncio
-from fastapi.testclient import TestClient
-from unittest.mock import Mock, patch, MagicMock
-
-from main import app
-from models import ChatMessage, ChatCompletionRequest, FunctionCall
-from services import ChatGPTService
-from drivers import ChatGPTDriver
-
-
+from unittest.mock import Mock, patch
+
+from models import ChatMessage, ChatCompletionRequest
+
+
+# 不変のリクエストボディはモジュール読み込み時に1回だけシリアライズして使い回す
+_JSON_HEADERS = {"content-type": "application/json"}
+
+# エラー系テストで共通に送る最小限のリクエスト（応答はモックが決めるため本文の内容は問わない）
+_BASIC_REQ_BODY = json.dumps({
+    "model": "gpt-3.5-turbo",
+    "messages": [{"role": "user", "content": "Test"}]
+}).encode("utf-8")
+
+# 応答要素のセレクター（ドライバーのポーリング結果を模擬する際に使う）
+_CONTAINER_SELECTOR = "[data-message-author-role='assistant']:last-child"
+_MARKDOWN_SELECTOR = "[data-message-author-role='assistant']:last-child div[class*='markdown']"
+
+# 通常チャットのストリーミングリクエスト
+_STREAM_REQ_DATA = {
+    "model": "gpt-3.5-turbo",
+    "messages": [{"role": "user", "content": "Say hello"}],
+    "stream": True
+}
+
+_FUNC_REQ_BODY = json.dumps({
+    "model": "gpt-3.5-turbo",
+    "messages": [
+        {"role": "user", "content": "What's the weather like in Tokyo?"}
+    ],
+    "functions": [
+        {
+            "name": "get_weather",
+            "description": "Get the current weather in a given location",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "location": {
+                        "type": "string",
+                        "description": "The city and state, e.g. San Francisco, CA"
+                    }
+                },
+                "required": ["location"]
+            }
+        }
+    ],
+    "function_call": "auto"
+}).encode("utf-8")
+
+_TOOLS_REQ_BODY = json.dumps({
+    "model": "gpt-3.5-turbo",
+    "messages": [
+        {"role": "user", "content": "Calculate the area of a 5x3 rectangle"}
+    ],
+    "tools": [
+        {
+            "type": "function",
+            "function": {
+                "name": "calculate_area",
+                "description": "Calculate area of a rectangle",
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        "width": {"type": "number"},
+                        "height": {"type": "number"}
+                    },
+                    "required": ["width", "height"]
+                }
+            }
+        }
+    ],
+    "tool_choice": "auto"
+}).encode("utf-8")
+
+
+# モックサービスが返す定型のチャット補完レスポンス（テストでは変更せず、そのまま返すだけ）
+_CHAT_SUCCESS_RESPONSE = {
+    "id": "chatcmpl-test",
+    "object": "chat.completion",
+    "created": 1677652288,
+    "model": "gpt-3.5-turbo",
+    "choices": [{
+        "index": 0,
+        "message": {
+            "role": "assistant",
+            "content": "Hello! How can I help you today?"
+        },
+        "finish_reason": "stop"
+    }],
+    "usage": {
+        "prompt_tokens": 9,
+        "completion_tokens": 12,
+        "total_tokens": 21
+    }
+}
+
+_CHAT_STREAM_FALSE_RESPONSE = {
+    "id": "chatcmpl-test",
+    "object": "chat.completion",
+    "created": 1677652288,
+    "model": "gpt-3.5-turbo",
+    "choices": [{
+        "index": 0,
+        "message": {
+            "role": "assistant",
+            "content": "Test response"
+        },
+        "finish_reason": "stop"
+    }],
+    "usage": {
+        "prompt_tokens": 10,
+        "completion_tokens": 5,
+        "total_tokens": 15
+    }
+}
+
+_FUNC_CALL_RESPONSE = {
+    "id": "chatcmpl-func-test",
+    "object": "chat.completion",
+    "created": 1677652300,
+    "model": "gpt-3.5-turbo",
+    "choices": [{
+        "index": 0,
+        "message": {
+            "role": "assistant",
+            "content": None,
+            "function_call": {
+                "name": "get_weather",
+                "arguments": '{"location": "Tokyo"}'
+            }
+        },
+        "finish_reason": "function_call"
+    }],
+    "usage": {
+        "prompt_tokens": 45,
+        "completion_tokens": 10,
+        "total_tokens": 55
+    }
+}
+
+_TOOL_CALLS_RESPONSE = {
+    "id": "chatcmpl-tools-test",
+    "object": "chat.completion",
+    "created": 1677652301,
+    "model": "gpt-3.5-turbo",
+    "choices": [{
+        "index": 0,
+        "message": {
+            "role": "assistant",
+            "content": None,
+            "tool_calls": [{
+                "id": "call_123",
+                "type": "function",
+                "function": {
+                    "name": "calculate_area",
+                    "arguments": '{"width": 5, "height": 3}'
+                }
+            }]
+        },
+        "finish_reason": "tool_calls"
+    }],
+    "usage": {
+        "prompt_tokens": 50,
+        "completion_tokens": 15,
+        "total_tokens": 65
+    }
+}
+
+_SIMPLE_CHAT_RESPONSE = {
+    "id": "chatcmpl-test",
+    "object": "chat.completion",
+    "created": 1677652288,
+    "model": "gpt-3.5-turbo",
+    "choices": [{
+        "index": 0,
+        "message": {
+            "role": "assistant",
+            "content": "Test response"
+        },
+        "finish_reason": "stop"
+    }],
+    "usage": {
+        "prompt_tokens": 5,
+        "completion_tokens": 2,
+        "total_tokens": 7
+    }
+}
+
+
+# 境界値テスト用の大きなメッセージ本文（10KB、読み込み時に1回だけ生成）
+_LARGE_CONTENT = "x" * 10000
+
+
+@pytest.fixture(scope="session")
+def shared_service():
+    """セッション全体で共有するChatGPTService（ブラウザは起動しない）"""
+    from services import ChatGPTService
+    return ChatGPTService()
+
+
+@pytest.fixture
+def service(shared_service, monkeypatch):
+    """共有サービスをテストごとに初期状態で渡す
+
+    セッション確認時刻・応答キャッシュ・処理中リクエストは空の状態から始め、
+    テスト中に書き換えた属性はmonkeypatchにより終了時に元へ戻る。
+    """
+    from collections import OrderedDict
+
+    monkeypatch.setattr(shared_service, "_session_checked_at", 0.0)
+    monkeypatch.setattr(shared_service, "_response_cache", OrderedDict())
+    monkeypatch.setattr(shared_service, "_inflight", {})
+    for name in ("driver", "_response_cache_size", "_coalesce_requests"):
+        monkeypatch.setattr(shared_service, name, getattr(shared_service, name))
+    return shared_service
+
+
+@pytest.fixture(scope="module")
+def shared_driver():
+    """モジュール内で共有するChatGPTDriver（Seleniumを読み込めない環境ではスキップ）"""
+    try:
+        from drivers import ChatGPTDriver
+    except ImportError as e:
+        pytest.skip(f"ChatGPTDriver is unavailable: {e}")
+    return ChatGPTDriver()
+
+
+@pytest.fixture
+def driver(shared_driver, monkeypatch):
+    """共有ドライバーをテストごとに初期状態で渡す
+
+    テスト中に書き換えたセッション状態はmonkeypatchにより終了時に元へ戻る。
+    """
+    for name in ("selenium_wrapper", "wait", "_session_active"):
+        monkeypatch.setattr(shared_driver, name, getattr(shared_driver, name))
+    return shared_driver
+
+
+# ChatGPT画面のフッター・ログイン導線の文言（応答本文ではないテキスト）
+_FOOTER_PATTERNS = (
+    "ChatGPT の回答は必ずしも正しいとは限りません",
+    "重要な情報は確認するようにしてください",
+    "ChatGPT にメッセージを送ると、規約に同意し",
+    "プライバシーポリシーを読んだものとみなされます",
+    "無料でサインアップ",
+    "ログイン",
+)
+# 全パターンを1つの正規表現にまとめ、1回の走査で照合する
+_FOOTER_RE = re.compile("|".join(map(re.escape, _FOOTER_PATTERNS)))
+_LOGIN_INDICATOR_RE = re.compile(r"login-button|signup-button|auth")
+_CHATGPT_INDICATOR_RE = re.compile(r"prompt-textarea|contenteditable|composer-button")
+# 表示中の要素1件だけを返すfind_elementsの結果（ドライバーは結果を変更しないため共有する）
+_VISIBLE_ELEMENT = Mock(is_displayed=Mock(return_value=True))
+_VISIBLE_ELEMENTS = [_VISIBLE_ELEMENT]
+
+
+def _find_chatgpt_ui_only(by, selector):
+    """ログイン済み画面のfind_elements: ログインインジケーターは空、ChatGPTインジケーターは要素を返す"""
+    if _LOGIN_INDICATOR_RE.search(selector):
+        return []
+    if _CHATGPT_INDICATOR_RE.search(selector):
+        return _VISIBLE_ELEMENTS
+    return []
+
+
+@pytest.fixture(scope="module")
+def stream_test_response():
+    """ストリーミングテスト用の完成済みレスポンス
+
+    Mockの属性連鎖ではなく実際のモデルを検証なしで1回だけ組み立てて共有する。
+    """
+    from models import ChatCompletionResponse, ChatCompletionChoice, ChatCompletionUsage
+
+    return ChatCompletionResponse.model_construct(
+        id="chatcmpl-stream-test",
+        created=1677652289,
+        model="gpt-3.5-turbo",
+        choices=[ChatCompletionChoice.model_construct(
+            index=0,
+            message=ChatMessage.model_construct(role="assistant", content="Hello world!"),
+            finish_reason="stop"
+        )],
+        usage=ChatCompletionUsage.model_construct(prompt_tokens=5, completion_tokens=3, total_tokens=8)
+    )
+
+
+@pytest.fixture(scope="module")
+def user_msg():
+    """モジュール内で共有するユーザーメッセージ（検証済みインスタンスを使い回す）"""
+    return ChatMessage(role="user", content="Test")
+
+
+@pytest.fixture(scope="module")
+def sample_messages():
+    """最新ユーザーメッセージ取得用の会話履歴（変更しないためタプルで共有する）"""
+    return (
+        ChatMessage(role="system", content="System message"),
+        ChatMessage(role="user", content="First user message"),
+        ChatMessage(role="assistant", content="Assistant response"),
+        ChatMessage(role="user", content="Latest user message"),
+    )
+
+
+@pytest.fixture(scope="module")
+def hello_messages():
+    """トークン数推定用の会話履歴（12文字のユーザーメッセージ1件）"""
+    return (ChatMessage(role="user", content="Hello world!"),)
+
+
+@pytest.mark.asyncio(loop_scope="session")
 class TestChatGPTAPI:
     """ChatGPT API統合テストクラス"""
 
-    def setup_method(self):
-        """テストメソッド前のセットアップ"""
-        self.client = TestClient(app)
-
-    def test_root_endpoint(self):
+    async def test_root_endpoint(self, async_client):
         """ルートエンドポイントテスト"""
-        response = self.client.get("/")
+        response = await async_client.get("/")
         assert response.status_code == 200
         data = response.json()
         assert data["message"] == "ChatGPT Selenium API Server"
         assert "version" in data
         assert "status" in data
 
-    def test_health_check_endpoint(self):
+    async def test_health_check_endpoint(self, mock_service, async_client):
         """ヘルスチェックエンドポイントテスト"""
-        with patch('api.get_chatgpt_service') as mock_get_service:
-            mock_service = MagicMock()
-            mock_service.health_check.return_value = True
-            mock_get_service.return_value = mock_service
+        mock_service.health_check.return_value = True
 
-            response = self.client.get("/health")
-            assert response.status_code == 200
-            data = response.json()
-            assert data["status"] == "healthy"
-            assert "timestamp" in data
+        response = await async_client.get("/health")
+        assert response.status_code == 200
+        data = response.json()
+        assert data["status"] == "healthy"
+        assert "timestamp" in data
 
-    def test_models_endpoint(self):
+    async def test_models_endpoint(self, async_client):
         """モデル一覧エンドポイントテスト"""
-        response = self.client.get("/v1/models")
+        response = await async_client.get("/v1/models")
         assert response.status_code == 200
         data = response.json()
         assert data["object"] == "list"
         assert len(data["data"]) > 0
         assert any(model["id"] == "gpt-3.5-turbo" for model in data["data"])
 
-    @patch('api.get_chatgpt_service')
-    def test_chat_completions_success(self, mock_get_service):
+    async def test_chat_completions_success(self, mock_service, async_client):
         """チャット補完成功テスト"""
-        # モックサービスとレスポンス作成
-        mock_service = MagicMock()
-        mock_get_service.return_value = mock_service
-
-        mock_response = {
-            "id": "chatcmpl-test",
-            "object": "chat.completion",
-            "created": 1677652288,
-            "model": "gpt-3.5-turbo",
-            "choices": [{
-                "index": 0,
-                "message": {
-                    "role": "assistant",
-                    "content": "Hello! How can I help you today?"
-                },
-                "finish_reason": "stop"
-            }],
-            "usage": {
-                "prompt_tokens": 9,
-                "completion_tokens": 12,
-                "total_tokens": 21
-            }
-        }
-        mock_service.create_chat_completion.return_value = mock_response
+        mock_service.create_chat_completion.return_value = _CHAT_SUCCESS_RESPONSE
 
         # リクエスト送信
         request_data = {
@@ -85,12 +359,43 @@ class TestChatGPTAPI:
             "max_tokens": 100
         }
 
-        response = self.client.post("/v1/chat/completions", json=request_data)
+        response = await async_client.post("/v1/chat/completions", json=request_data)
         assert response.status_code == 200
         data = response.json()
         assert data["choices"][0]["message"]["content"] == "Hello! How can I help you today?"
 
-    def test_chat_completions_invalid_request(self):
+    async def test_chat_completions_concurrency_limited(self, mock_service, async_client, monkeypatch):
+        """チャット補完の同時実行数がセマフォで制限されることを確認"""
+        import threading
+        import api
+
+        active = 0
+        max_active = 0
+        counter_lock = threading.Lock()
+
+        def slow_completion(request):
+            nonlocal active, max_active
+            with counter_lock:
+                active += 1
+                max_active = max(max_active, active)
+            time.sleep(0.05)
+            with counter_lock:
+                active -= 1
+            return {"id": "chatcmpl-test", "object": "chat.completion", "choices": []}
+
+        mock_service.create_chat_completion.side_effect = slow_completion
+        request_data = {"model": "gpt-3.5-turbo", "messages": [{"role": "user", "content": "Hello"}]}
+
+        monkeypatch.setattr(api, "completion_semaphore", asyncio.Semaphore(2))
+        responses = await asyncio.gather(
+            *(async_client.post("/v1/chat/completions", json=request_data) for _ in range(4))
+        )
+
+        assert all(response.status_code == 200 for response in responses)
+        assert mock_service.create_chat_completion.call_count == 4
+        assert max_active <= 2
+
+    async def test_chat_completions_invalid_request(self, async_client):
         """チャット補完無効リクエストテスト"""
         # 必須フィールド不足
         request_data = {
@@ -98,60 +403,10 @@ class TestChatGPTAPI:
             # messagesフィールドが不足
         }
 
-        response = self.client.post("/v1/chat/completions", json=request_data)
+        response = await async_client.post("/v1/chat/completions", json=request_data)
         assert response.status_code == 422  # バリデーションエラー
 
-    def test_chat_completions_stream_unsupported(self):
-        """ストリーミング対応テスト"""
-        request_data = {
-            "model": "gpt-3.5-turbo",
-            "messages": [
-                {"role": "user", "content": "Hello"}
-            ],
-            "stream": True
-        }
-
-        # ストリーミングテストでもモックサービスを使用
-        with patch('api.get_chatgpt_service') as mock_get_service:
-            mock_service = MagicMock()
-            mock_get_service.return_value = mock_service
-
-            # モックレスポンス作成（適切なオブジェクト構造）
-            mock_response = Mock()
-            mock_response.id = "chatcmpl-stream-test"
-            mock_response.object = "chat.completion"
-            mock_response.created = 1677652289
-            mock_response.model = "gpt-3.5-turbo"
-
-            # choices配列を適切に設定
-            mock_choice = Mock()
-            mock_choice.index = 0
-            mock_choice.finish_reason = "stop"
-
-            # messageオブジェクトを適切に設定
-            mock_message = Mock()
-            mock_message.role = "assistant"
-            mock_message.content = "Hello! How can I help you?"
-            mock_choice.message = mock_message
-
-            mock_response.choices = [mock_choice]
-
-            # usage情報を設定
-            mock_usage = Mock()
-            mock_usage.prompt_tokens = 5
-            mock_usage.completion_tokens = 6
-            mock_usage.total_tokens = 11
-            mock_response.usage = mock_usage
-
-            mock_service.create_chat_completion.return_value = mock_response
-
-            response = self.client.post("/v1/chat/completions", json=request_data)
-            # ストリーミングレスポンスは200で返される
-            assert response.status_code == 200
-            # ストリーミングのContent-Typeを確認
-            assert "text/plain" in response.headers.get("content-type", "")
-
-    def test_chat_completions_stream_false(self):
+    async def test_chat_completions_stream_false(self, mock_service, async_client):
         """非ストリーミングテスト（従来通り）"""
         request_data = {
             "model": "gpt-3.5-turbo",
@@ -162,71 +417,21 @@ class TestChatGPTAPI:
         }
 
         # 非ストリーミングの場合は従来通りJSONレスポンス
-        with patch('api.get_chatgpt_service') as mock_get_service:
-            mock_service = MagicMock()
-            mock_get_service.return_value = mock_service
-
-            # モックレスポンス作成（辞書形式で直接返す）
-            mock_response = {
-                "id": "chatcmpl-test",
-                "object": "chat.completion",
-                "created": 1677652288,
-                "model": "gpt-3.5-turbo",
-                "choices": [{
-                    "index": 0,
-                    "message": {
-                        "role": "assistant",
-                        "content": "Test response"
-                    },
-                    "finish_reason": "stop"
-                }],
-                "usage": {
-                    "prompt_tokens": 10,
-                    "completion_tokens": 5,
-                    "total_tokens": 15
-                }
-            }
-            mock_service.create_chat_completion.return_value = mock_response
+        mock_service.create_chat_completion.return_value = _CHAT_STREAM_FALSE_RESPONSE
 
-            response = self.client.post("/v1/chat/completions", json=request_data)
-            assert response.status_code == 200
-            data = response.json()
-            assert data["choices"][0]["message"]["content"] == "Test response"
+        response = await async_client.post("/v1/chat/completions", json=request_data)
+        assert response.status_code == 200
+        data = response.json()
+        assert data["choices"][0]["message"]["content"] == "Test response"
 
-    @patch('api.get_chatgpt_service')
-    def test_chat_completions_streaming_format(self, mock_get_service):
+    @pytest.mark.parametrize("deltas", [
+        ["Hello! How can I help you?"],  # 1回で全文が届く場合
+        ["Hello", " world", "!"],  # ブラウザ上で生成中の応答が増分で届く場合
+    ])
+    async def test_chat_completions_streaming_format(self, mock_service, async_client, stream_test_response, deltas):
         """ストリーミング形式の詳細テスト"""
-        mock_service = MagicMock()
-        mock_get_service.return_value = mock_service
-
-        # モックレスポンス作成（適切なオブジェクト構造）
-        mock_response = Mock()
-        mock_response.id = "chatcmpl-stream-test"
-        mock_response.object = "chat.completion"
-        mock_response.created = 1677652289
-        mock_response.model = "gpt-3.5-turbo"
-
-        # choices配列を適切に設定
-        mock_choice = Mock()
-        mock_choice.index = 0
-        mock_choice.finish_reason = "stop"
-
-        # messageオブジェクトを適切に設定
-        mock_message = Mock()
-        mock_message.role = "assistant"
-        mock_message.content = "Hello world!"
-        mock_choice.message = mock_message
-
-        mock_response.choices = [mock_choice]
-
-        # usage情報を設定
-        mock_usage = Mock()
-        mock_usage.prompt_tokens = 5
-        mock_usage.completion_tokens = 3
-        mock_usage.total_tokens = 8
-        mock_response.usage = mock_usage
-
-        mock_service.create_chat_completion.return_value = mock_response
+        mock_service.create_chat_completion.return_value = stream_test_response
+        mock_service.create_chat_completion_stream.return_value = (delta for delta in deltas)
 
         request_data = {
             "model": "gpt-3.5-turbo",
@@ -236,176 +441,173 @@ class TestChatGPTAPI:
             "stream": True
         }
 
-        response = self.client.post("/v1/chat/completions", json=request_data)
-        assert response.status_code == 200
-        assert "text/plain" in response.headers.get("content-type", "")
+        # 本文をまとめて読み込まず、SSEの行を届いた順に読む
+        async with async_client.stream("POST", "/v1/chat/completions", json=request_data) as response:
+            assert response.status_code == 200
+            assert "text/event-stream" in response.headers.get("content-type", "")
+            events = [line[len("data: "):] async for line in response.aiter_lines() if line.startswith("data: ")]
 
         # ストリーミングレスポンスの内容確認
-        content = response.content.decode('utf-8')
-        assert "data: " in content
-        assert "[DONE]" in content
-        assert "chat.completion.chunk" in content
+        assert events[-1] == "[DONE]"
+        assert all('"chat.completion.chunk"' in event for event in events[:-1])
+
+        # 全チャンクのdeltaを連結すると元の応答に戻ること（最終チャンクで内容が欠けない）
+        chunks = [json.loads(event) for event in events[:-1]]
+        assert len({chunk["id"] for chunk in chunks}) == 1
+        assert [chunk["choices"][0]["delta"].get("content") for chunk in chunks[1:-1]] == deltas
+        assert "".join(chunk["choices"][0]["delta"].get("content", "") for chunk in chunks) == "".join(deltas)
+        assert chunks[-1]["choices"][0]["finish_reason"] == "stop"
+        # 通常チャットのストリーミングでは全文取得を待たない
+        mock_service.create_chat_completion.assert_not_called()
+
+    async def test_chat_completions_stream_error_event(self, mock_service, async_client):
+        """ストリーミング途中のエラーがエラーイベントとして通知されることを確認"""
+
+        def failing_stream():
+            yield "Partial"
+            raise RuntimeError("ChatGPTのログインセッションが期限切れです。")
+
+        mock_service.create_chat_completion_stream.return_value = failing_stream()
 
-    @patch('api.get_chatgpt_service')
-    def test_chat_completions_with_functions(self, mock_get_service):
-        """Function Calling付きチャット補完テスト"""
-        # モックサービス作成
-        mock_service = MagicMock()
-        mock_get_service.return_value = mock_service
-
-        # モックレスポンス作成（Function Call応答を辞書で作成）
-        mock_response = {
-            "id": "chatcmpl-func-test",
-            "object": "chat.completion",
-            "created": 1677652300,
-            "model": "gpt-3.5-turbo",
-            "choices": [{
-                "index": 0,
-                "message": {
-                    "role": "assistant",
-                    "content": None,
-                    "function_call": {
-                        "name": "get_weather",
-                        "arguments": '{"location": "Tokyo"}'
-                    }
-                },
-                "finish_reason": "function_call"
-            }],
-            "usage": {
-                "prompt_tokens": 45,
-                "completion_tokens": 10,
-                "total_tokens": 55
-            }
-        }
-        mock_service.create_chat_completion.return_value = mock_response        # Function定義付きリクエスト送信
         request_data = {
             "model": "gpt-3.5-turbo",
-            "messages": [
-                {"role": "user", "content": "What's the weather like in Tokyo?"}
-            ],
-            "functions": [
-                {
-                    "name": "get_weather",
-                    "description": "Get the current weather in a given location",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "location": {
-                                "type": "string",
-                                "description": "The city and state, e.g. San Francisco, CA"
-                            }
-                        },
-                        "required": ["location"]
-                    }
-                }
-            ],
-            "function_call": "auto"
+            "messages": [{"role": "user", "content": "Say hello"}],
+            "stream": True
         }
 
-        response = self.client.post("/v1/chat/completions", json=request_data)
+        response = await async_client.post("/v1/chat/completions", json=request_data)
+        assert response.status_code == 200
+
+        events = [line[len("data: "):] for line in response.content.decode('utf-8').splitlines() if line.startswith("data: ")]
+        assert "[DONE]" not in events
+        assert json.loads(events[-1])["error"]["code"] == "authentication_required"
+
+    @pytest.mark.parametrize("deltas, expected", [
+        # 考え中メッセージが増分の途中で区切られても除去される
+        (["I am thin", "king about how to help you", "...\n", "Real answer"], "Real answer"),
+        (["Hello. I'm think", "ing about how to help you. World"], "Hello. World"),
+        # 書き出しが一致しただけの本文は保留後にそのまま送る
+        (["I am thin", "ner than before"], "I am thinner than before"),
+    ])
+    async def test_chat_completions_stream_filters_thinking_message(self, mock_service, async_client, deltas, expected):
+        """ストリーミングでも考え中メッセージが除去されることを確認"""
+        mock_service.create_chat_completion_stream.return_value = (delta for delta in deltas)
+
+        response = await async_client.post("/v1/chat/completions", json=_STREAM_REQ_DATA)
+        events = [line[len("data: "):] for line in response.content.decode('utf-8').splitlines() if line.startswith("data: ")]
+
+        assert events[-1] == "[DONE]"
+        chunks = [json.loads(event) for event in events[:-1]]
+        assert "".join(chunk["choices"][0]["delta"].get("content", "") for chunk in chunks) == expected
+        assert chunks[-1]["choices"][0]["finish_reason"] == "stop"
+
+    @pytest.mark.parametrize("deltas, code", [
+        (["I am thinking about ", "how to help you..."], "internal_error"),  # 除去後に内容が残らない
+        (["This is a mock ", "response for testing"], "service_unavailable"),  # 模擬応答
+    ])
+    async def test_chat_completions_stream_rejects_unusable_response(self, mock_service, async_client, deltas, code):
+        """ストリーミングで使えない応答は完了ではなくエラーイベントで終わることを確認"""
+        mock_service.create_chat_completion_stream.return_value = (delta for delta in deltas)
+
+        response = await async_client.post("/v1/chat/completions", json=_STREAM_REQ_DATA)
+        events = [line[len("data: "):] for line in response.content.decode('utf-8').splitlines() if line.startswith("data: ")]
+
+        assert "[DONE]" not in events
+        assert '"finish_reason":"stop"' not in response.text
+        assert json.loads(events[-1])["error"]["code"] == code
+
+    @pytest.mark.parametrize("snapshots", [
+        # 広いコンテナからmarkdown要素へ切り替わり、空白の入り方が変わる
+        [(_CONTAINER_SELECTOR, "Hello  world"), (_CONTAINER_SELECTOR, "Hello  world, this"),
+         (_MARKDOWN_SELECTOR, "Hello world, this is"), (_MARKDOWN_SELECTOR, "Hello world, this is the full reply.")],
+        # 切り替え後にそれ以上更新されないまま応答が完了する
+        [(_CONTAINER_SELECTOR, "Hello"), (_CONTAINER_SELECTOR, "Hello world"),
+         (_MARKDOWN_SELECTOR, "Hello world, this is the full reply.")],
+    ])
+    async def test_chat_completions_stream_selector_changed(self, mock_service, async_client, driver, monkeypatch, snapshots):
+        """応答要素のセレクターが途中で切り替わっても、応答全体が届くことを確認"""
+        monkeypatch.setattr(driver, "_send_and_poll_response", lambda message: iter(snapshots))
+        mock_service.create_chat_completion_stream.return_value = driver.send_message_stream("test")
+
+        response = await async_client.post("/v1/chat/completions", json=_STREAM_REQ_DATA)
+        events = [line[len("data: "):] for line in response.content.decode('utf-8').splitlines() if line.startswith("data: ")]
+
+        assert events[-1] == "[DONE]"
+        chunks = [json.loads(event) for event in events[:-1]]
+        content = "".join(chunk["choices"][0]["delta"].get("content", "") for chunk in chunks)
+        assert " ".join(content.split()) == "Hello world, this is the full reply."
+        assert chunks[-1]["choices"][0]["finish_reason"] == "stop"
+
+    async def test_chat_completions_stream_prefix_rewritten(self, mock_service, async_client, driver, monkeypatch):
+        """送出済みの部分が書き換わっても、応答を打ち切らず完成した応答の末尾まで送ることを確認"""
+        snapshots = [
+            (_MARKDOWN_SELECTOR, "I am thinking"),
+            (_MARKDOWN_SELECTOR, "I am thinking about how to help you. Real"),
+            (_MARKDOWN_SELECTOR, "Real answer"),
+        ]
+        monkeypatch.setattr(driver, "_send_and_poll_response", lambda message: iter(snapshots))
+        mock_service.create_chat_completion_stream.return_value = driver.send_message_stream("test")
+
+        response = await async_client.post("/v1/chat/completions", json=_STREAM_REQ_DATA)
+        events = [line[len("data: "):] for line in response.content.decode('utf-8').splitlines() if line.startswith("data: ")]
+
+        assert events[-1] == "[DONE]"
+        chunks = [json.loads(event) for event in events[:-1]]
+        assert "".join(chunk["choices"][0]["delta"].get("content", "") for chunk in chunks).endswith("Real answer")
+        assert chunks[-1]["choices"][0]["finish_reason"] == "stop"
+
+    async def test_relay_streaming_response_releases_driver_on_disconnect(self, service, monkeypatch):
+        """増分の取得中にクライアントが切断しても、ドライバーのロックが解放されることを確認"""
+        import anyio
+        from api import relay_streaming_response
+
+        release = threading.Event()
+
+        def send_message_stream(message):
+            yield "Hel"
+            release.wait(5)
+            yield "lo"
+
+        mock_driver = Mock()
+        mock_driver.send_message_stream.side_effect = send_message_stream
+        monkeypatch.setattr(service, "driver", mock_driver)
+        request = ChatCompletionRequest(model="gpt-3.5-turbo", messages=[ChatMessage(role="user", content="Hi")], stream=True)
+
+        # 2回目のnext()がワーカースレッドで実行中のまま切断（キャンセル）される
+        timer = threading.Timer(0.3, release.set)
+        timer.start()
+        with anyio.move_on_after(0.1):
+            async for _ in relay_streaming_response(service._stream_message("Hi"), request, "chatcmpl-test", 0):
+                pass
+        timer.join()
+
+        assert not service._driver_lock.locked()
+
+    async def test_chat_completions_with_functions(self, mock_service, async_client):
+        """Function Calling付きチャット補完テスト"""
+        mock_service.create_chat_completion.return_value = _FUNC_CALL_RESPONSE
+
+        # Function定義付きリクエスト送信
+        response = await async_client.post("/v1/chat/completions", content=_FUNC_REQ_BODY, headers=_JSON_HEADERS)
         assert response.status_code == 200
         data = response.json()
         assert data["choices"][0]["finish_reason"] == "function_call"
         assert data["choices"][0]["message"]["function_call"]["name"] == "get_weather"
 
-    @patch('api.get_chatgpt_service')
-    def test_chat_completions_with_tools(self, mock_get_service):
+    async def test_chat_completions_with_tools(self, mock_service, async_client):
         """Tools API形式でのFunction Callingテスト"""
-        # モックサービス作成
-        mock_service = MagicMock()
-        mock_get_service.return_value = mock_service
-
-        # モックレスポンス作成（Tool Calls応答を辞書で作成）
-        mock_response = {
-            "id": "chatcmpl-tools-test",
-            "object": "chat.completion",
-            "created": 1677652301,
-            "model": "gpt-3.5-turbo",
-            "choices": [{
-                "index": 0,
-                "message": {
-                    "role": "assistant",
-                    "content": None,
-                    "tool_calls": [{
-                        "id": "call_123",
-                        "type": "function",
-                        "function": {
-                            "name": "calculate_area",
-                            "arguments": '{"width": 5, "height": 3}'
-                        }
-                    }]
-                },
-                "finish_reason": "tool_calls"
-            }],
-            "usage": {
-                "prompt_tokens": 50,
-                "completion_tokens": 15,
-                "total_tokens": 65
-            }
-        }
-
-        mock_service.create_chat_completion.return_value = mock_response
+        mock_service.create_chat_completion.return_value = _TOOL_CALLS_RESPONSE
 
         # Tools形式リクエスト送信
-        request_data = {
-            "model": "gpt-3.5-turbo",
-            "messages": [
-                {"role": "user", "content": "Calculate the area of a 5x3 rectangle"}
-            ],
-            "tools": [
-                {
-                    "type": "function",
-                    "function": {
-                        "name": "calculate_area",
-                        "description": "Calculate area of a rectangle",
-                        "parameters": {
-                            "type": "object",
-                            "properties": {
-                                "width": {"type": "number"},
-                                "height": {"type": "number"}
-                            },
-                            "required": ["width", "height"]
-                        }
-                    }
-                }
-            ],
-            "tool_choice": "auto"
-        }
-
-        response = self.client.post("/v1/chat/completions", json=request_data)
+        response = await async_client.post("/v1/chat/completions", content=_TOOLS_REQ_BODY, headers=_JSON_HEADERS)
         assert response.status_code == 200
         data = response.json()
         assert data["choices"][0]["finish_reason"] == "tool_calls"
         assert data["choices"][0]["message"]["tool_calls"][0]["function"]["name"] == "calculate_area"
 
-    @patch('api.get_chatgpt_service')
-    def test_chat_completions_invalid_function_call(self, mock_get_service):
+    async def test_chat_completions_invalid_function_call(self, mock_service, async_client):
         """無効なFunction Call設定テスト"""
-        # モックサービス作成
-        mock_service = MagicMock()
-        mock_get_service.return_value = mock_service
-
-        # 簡単なレスポンス用意
-        mock_response = {
-            "id": "chatcmpl-test",
-            "object": "chat.completion",
-            "created": 1677652288,
-            "model": "gpt-3.5-turbo",
-            "choices": [{
-                "index": 0,
-                "message": {
-                    "role": "assistant",
-                    "content": "Test response"
-                },
-                "finish_reason": "stop"
-            }],
-            "usage": {
-                "prompt_tokens": 5,
-                "completion_tokens": 2,
-                "total_tokens": 7
-            }
-        }
-        mock_service.create_chat_completion.return_value = mock_response
+        mock_service.create_chat_completion.return_value = _SIMPLE_CHAT_RESPONSE
 
         request_data = {
             "model": "gpt-3.5-turbo",
@@ -415,66 +617,30 @@ class TestChatGPTAPI:
             "function_call": "invalid_setting"  # 無効な設定
         }
 
-        response = self.client.post("/v1/chat/completions", json=request_data)
+        response = await async_client.post("/v1/chat/completions", json=request_data)
         # Pydanticバリデーションエラーまたは正常処理を期待
         # （実装依存だが、エラーにならないことを確認）
         assert response.status_code in [200, 422]
 
-    def test_function_message_role(self):
-        """Function roleメッセージテスト"""
-        request_data = {
-            "model": "gpt-3.5-turbo",
-            "messages": [
-                {"role": "user", "content": "What's the weather?"},
-                {
-                    "role": "assistant",
-                    "content": None,
-                    "function_call": {
-                        "name": "get_weather",
-                        "arguments": '{"location": "Tokyo"}'
-                    }
-                },
-                {
-                    "role": "function",
-                    "name": "get_weather",
-                    "content": '{"temperature": "22°C", "condition": "sunny"}'
-                }
-            ]
-        }
-
-        # バリデーションテスト（エラーなく受け入れられることを確認）
-        response = self.client.post("/v1/chat/completions", json=request_data)
-        # 実装状況により200または処理エラーを期待
-        assert response.status_code in [200, 400, 401, 422, 500]
-
 
 class TestChatGPTService:
     """ChatGPTServiceユニットテストクラス"""
 
-    def setup_method(self):
-        """テストメソッド前のセットアップ"""
-        self.service = ChatGPTService()
-
-    @patch('services.ChatGPTDriver')
-    def test_create_chat_completion_success(self, mock_driver_class):
+    def test_create_chat_completion_success(self, service, monkeypatch, user_msg):
         """チャット補完成功テスト"""
         # モックドライバー設定
         mock_driver = Mock()
         mock_driver.is_session_active.return_value = True
         mock_driver.send_message.return_value = "Test response"
-        mock_driver_class.return_value = mock_driver
 
         # テストリクエスト作成
         request = ChatCompletionRequest(
             model="gpt-3.5-turbo",
-            messages=[
-                ChatMessage(role="user", content="Test message")
-            ]
+            messages=[user_msg]
         )
 
-        # サービス初期化（モックドライバー使用）
-        service = ChatGPTService()
-        service.driver = mock_driver
+        # 共有サービスにモックドライバーを設定（テスト終了時に元へ戻る）
+        monkeypatch.setattr(service, "driver", mock_driver)
 
         # チャット補完実行
         response = service.create_chat_completion(request)
@@ -484,49 +650,202 @@ class TestChatGPTService:
         assert response.choices[0].message.role == "assistant"
         assert response.model == "gpt-3.5-turbo"
 
-    def test_get_latest_user_message(self):
-        """最新ユーザーメッセージ取得テスト"""
-        messages = [
-            ChatMessage(role="system", content="System message"),
-            ChatMessage(role="user", content="First user message"),
-            ChatMessage(role="assistant", content="Assistant response"),
-            ChatMessage(role="user", content="Latest user message")
-        ]
+    def test_build_combined_message(self, service):
+        """システム・ユーザーメッセージ統合テスト"""
+        system = ChatMessage(role="system", content="Be brief.")
+        first = ChatMessage(role="user", content="First question")
+        assistant = ChatMessage(role="assistant", content="First answer")
+        latest = ChatMessage(role="user", content="Latest question")
+
+        assert service._build_combined_message([system, first, assistant, latest]) == \
+            "Be brief. Please respond to this user request: Latest question"
+        assert service._build_combined_message([first, assistant, latest]) == "User: Latest question"
+        assert service._build_combined_message([system]) == "Be brief."
+        assert service._build_combined_message([assistant]) == ""
+
+    def test_thinking_message_removed(self, service, user_msg):
+        """「考え中」メッセージ除去テスト"""
+        mock_driver = Mock()
+        mock_driver.is_session_active.return_value = True
+        service.driver = mock_driver
+
+        request = ChatCompletionRequest(
+            model="gpt-3.5-turbo",
+            messages=[user_msg]
+        )
+
+        mock_driver.send_message.return_value = "I'm thinking about how to help you... Here is the answer."
+        response = service.create_chat_completion(request)
+        assert response.choices[0].message.content == "Here is the answer."
+
+        # 複数の言い回しや大文字小文字の違いもまとめて除去する
+        mock_driver.send_message.return_value = "I AM THINKING ABOUT HOW TO HELP YOU. Answer. Let me think about how to help you..."
+        response = service.create_chat_completion(request)
+        assert response.choices[0].message.content == "Answer."
+
+        # 「考え中」メッセージしかない場合は不完全な応答として扱う
+        mock_driver.send_message.return_value = "Let me think about how to help you."
+        assert service.create_chat_completion(request) is None
+
+    def test_session_check_reused_until_failure(self, service, user_msg):
+        """セッション確認結果の再利用と送信失敗時の再確認テスト"""
+        mock_driver = Mock()
+        mock_driver.is_session_active.return_value = True
+        mock_driver.send_message.return_value = "Test response"
+        service.driver = mock_driver
+
+        request = ChatCompletionRequest(
+            model="gpt-3.5-turbo",
+            messages=[user_msg]
+        )
+
+        assert service.create_chat_completion(request) is not None
+        assert service.create_chat_completion(request) is not None
+        assert mock_driver.is_session_active.call_count == 1
+
+        # 応答取得に失敗すると、次のリクエストでセッションを確認し直す
+        mock_driver.send_message.return_value = None
+        assert service.create_chat_completion(request) is None
+        mock_driver.send_message.return_value = "Recovered"
+        assert service.create_chat_completion(request) is not None
+        assert mock_driver.is_session_active.call_count == 2
+
+    def test_response_cache_reuses_identical_messages(self, service):
+        """応答キャッシュ有効時に同一メッセージでブラウザ送信を省略することを確認"""
+        mock_driver = Mock()
+        mock_driver.send_message.side_effect = lambda message: f"answer to {message}"
+        service.driver = mock_driver
+        service._response_cache_size = 1
+
+        assert service._send_message("question A") == "answer to question A"
+        assert service._send_message("question A") == "answer to question A"
+        assert mock_driver.send_message.call_count == 1
+
+        # 上限を超えると古いエントリから破棄される
+        service._send_message("question B")
+        service._send_message("question A")
+        assert mock_driver.send_message.call_count == 3
+
+    def test_identical_inflight_requests_coalesced(self, service):
+        """処理中の同一メッセージがブラウザへ1回だけ送信され、応答が共有されることを確認"""
+        import threading
+
+        started = threading.Event()
+        release = threading.Event()
+
+        def blocking_send(message):
+            started.set()
+            release.wait(timeout=5)
+            return f"answer to {message}"
+
+        mock_driver = Mock()
+        mock_driver.send_message.side_effect = blocking_send
+        service.driver = mock_driver
+        service._coalesce_requests = True
+
+        joined = threading.Event()
+
+        def log_info(msg, *args):
+            if msg.startswith("Identical request in flight"):
+                joined.set()
+
+        results = []
+        with patch('services.logger.info', side_effect=log_info):
+            leader = threading.Thread(target=lambda: results.append(service._send_message("same question")))
+            leader.start()
+            assert started.wait(timeout=5)
+            follower = threading.Thread(target=lambda: results.append(service._send_message("same question")))
+            follower.start()
+            # 後続リクエストが処理中のFutureに合流してから先行リクエストを完了させる
+            assert joined.wait(timeout=5)
+            release.set()
+            leader.join()
+            follower.join()
+
+        assert results == ["answer to same question", "answer to same question"]
+        assert mock_driver.send_message.call_count == 1
+        assert service._inflight == {}
+
+        # 処理中でなければ通常どおり送信する
+        service._send_message("same question")
+        assert mock_driver.send_message.call_count == 2
+
+    def test_send_message_serialized_across_threads(self, service):
+        """複数スレッドからの送信がドライバー上で直列化されることを確認"""
+        import threading
+
+        active = 0
+        max_active = 0
+        counter_lock = threading.Lock()
+
+        def slow_send(message):
+            nonlocal active, max_active
+            with counter_lock:
+                active += 1
+                max_active = max(max_active, active)
+            time.sleep(0.05)
+            with counter_lock:
+                active -= 1
+            return f"echo: {message}"
+
+        mock_driver = Mock()
+        mock_driver.send_message.side_effect = slow_send
+        service.driver = mock_driver
 
-        latest = self.service._get_latest_user_message(messages)
+        threads = [threading.Thread(target=service._send_message, args=(f"msg{i}",)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert mock_driver.send_message.call_count == 4
+        assert max_active == 1
+
+    def test_get_latest_user_message(self, service, sample_messages):
+        """最新ユーザーメッセージ取得テスト"""
+        latest = service._get_latest_user_message(list(sample_messages))
         assert latest is not None
         assert latest.content == "Latest user message"
 
-    def test_estimate_tokens(self):
+    def test_estimate_tokens(self, service, hello_messages):
         """トークン数推定テスト"""
-        messages = [
-            ChatMessage(role="user", content="Hello world!")  # 12文字
-        ]
-
-        tokens = self.service._estimate_tokens(messages)
+        tokens = service._estimate_tokens(list(hello_messages))
         assert tokens >= 1
         assert tokens == 12 // 4  # 文字数/4の計算
 
 
+@pytest.mark.xdist_group("selenium")
 class TestChatGPTDriver:
     """ChatGPTDriverユニットテストクラス"""
 
-    def setup_method(self):
-        """テストメソッド前のセットアップ"""
-        self.driver = ChatGPTDriver()
+    @pytest.fixture(autouse=True, scope="class")
+    def _no_browser(self, shared_driver):
+        """クラス内のテストで実ブラウザを起動しないよう、SeleniumWrapperを1回だけモックに差し替える"""
+        with pytest.MonkeyPatch.context() as mp:
+            mp.setattr("drivers.SeleniumWrapper", Mock())
+            yield
+
+    @pytest.fixture(autouse=True)
+    def selenium_driver(self, driver):
+        """テストごとにモックのSeleniumWrapperをドライバーへ設定し、その中のWebDriverモックを返す
+
+        selenium_wrapperはdriverフィクスチャによりテスト終了時に元へ戻る。
+        """
+        mock_driver = Mock(session_id="test-session")
+        driver.selenium_wrapper = Mock(driver=mock_driver)
+        return mock_driver
 
-    @patch('drivers.selenium_wrapper.SeleniumWrapper')
-    def test_create_chrome_driver(self, mock_wrapper_class):
+    def test_create_chrome_driver(self, driver, monkeypatch):
         """Chromeドライバー作成テスト（SeleniumWrapper使用）"""
-        # モック設定
+        # モック設定（drivers内で参照しているSeleniumWrapperを差し替える）
         mock_wrapper = Mock()
         mock_wrapper.driver = Mock()
         mock_wrapper.driver.session_id = "test-session"
-        mock_wrapper_class.get_instance.return_value = mock_wrapper
+        monkeypatch.setattr("drivers.SeleniumWrapper", Mock(get_instance=Mock(return_value=mock_wrapper)))
 
         # ドライバー作成テスト
         try:
-            result = self.driver.start_session()
+            result = driver.start_session()
             assert result == True or mock_wrapper.driver is not None
         except Exception as e:
             # SeleniumWrapperの問題はテスト環境での制限事項として許容
@@ -535,136 +854,117 @@ class TestChatGPTDriver:
             else:
                 raise
 
-    def test_session_state_management(self):
+    def test_session_state_management(self, driver):
         """セッション状態管理テスト"""
         # 初期状態
-        assert not self.driver.is_session_active()
-
-        # セッション状態テスト（SeleniumWrapper使用）
-        with patch('drivers.selenium_wrapper.SeleniumWrapper') as mock_wrapper_class:
-            mock_wrapper = Mock()
-            mock_wrapper.driver = Mock()
-            mock_wrapper.driver.session_id = "test-session-id"
-            mock_wrapper_class.get_instance.return_value = mock_wrapper
-
-            # SeleniumWrapperインスタンスを設定
-            self.driver.selenium_wrapper = mock_wrapper
-            self.driver._session_active = True
-
-            # セッション状態確認
-            assert self.driver.is_session_active()
-            assert hasattr(self.driver, '_session_active')
-            # 実際の状態確認関数をテスト
-            result = self.driver._session_active if hasattr(self.driver, '_session_active') else False
-            assert result == True
-
-            self.driver._session_active = False
-            assert not self.driver.is_session_active()
-
-    def test_login_state_check(self):
-        """ログイン状態チェックテスト"""
-        with patch('drivers.selenium_wrapper.SeleniumWrapper') as mock_wrapper_class:
-            mock_wrapper = Mock()
-            mock_driver = Mock()
-            mock_wrapper.driver = mock_driver
-            mock_wrapper_class.get_instance.return_value = mock_wrapper
+        assert not driver.is_session_active()
+
+        # セッション状態テスト（モックのSeleniumWrapperが設定済み）
+        driver._session_active = True
 
-            driver = ChatGPTDriver()
-            driver.selenium_wrapper = mock_wrapper
+        # セッション状態確認
+        assert driver.is_session_active()
+        assert hasattr(driver, '_session_active')
+        # 実際の状態確認関数をテスト
+        result = driver._session_active if hasattr(driver, '_session_active') else False
+        assert result == True
 
+        driver._session_active = False
+        assert not driver.is_session_active()
+
+    @pytest.mark.parametrize("logged_in", [False, True])
+    def test_login_state_check(self, driver, selenium_driver, logged_in):
+        """ログイン状態チェックテスト"""
+        if logged_in:
+            # ChatGPT要素が存在する場合（ログイン済み）
+            selenium_driver.find_elements.side_effect = _find_chatgpt_ui_only
+        else:
             # ログインボタンが存在する場合（未ログイン）
             # すべてのログインインジケーターでボタンが見つかる
-            mock_driver.find_elements.return_value = [Mock(is_displayed=Mock(return_value=True))]
-            assert not driver._check_login_status()
+            selenium_driver.find_elements.return_value = _VISIBLE_ELEMENTS
 
-            # ChatGPT要素が存在する場合（ログイン済み）
-            # ログインインジケーターは空、ChatGPTインジケーターで要素が見つかる
-            def side_effect_func(by, selector):
-                # ログインインジケーターは全て空を返す
-                if any(indicator in selector for indicator in ['login-button', 'signup-button', 'auth']):
-                    return []
-                # ChatGPTインジケーターは要素を返す
-                elif any(indicator in selector for indicator in ['prompt-textarea', 'contenteditable', 'composer-button']):
-                    return [Mock(is_displayed=Mock(return_value=True))]
-                else:
-                    return []
-
-            mock_driver.find_elements.side_effect = side_effect_func
-            assert driver._check_login_status()
-
-    def test_login_required_error_handling(self):
+        assert driver._check_login_status() == logged_in
+
+    def test_login_required_error_handling(self, driver, monkeypatch):
         """ログイン必須エラーハンドリングテスト"""
-        with patch('drivers.selenium_wrapper.SeleniumWrapper') as mock_wrapper_class:
-            mock_wrapper = Mock()
-            mock_driver = Mock()
-            mock_wrapper.driver = mock_driver
-            mock_wrapper_class.get_instance.return_value = mock_wrapper
+        driver._session_active = True
 
-            driver = ChatGPTDriver()
-            driver.selenium_wrapper = mock_wrapper
-            driver._session_active = True
+        # ログイン状態チェックでFalseを返す
+        monkeypatch.setattr(driver, "_check_login_status", lambda: False)
+        with pytest.raises(RuntimeError) as exc_info:
+            driver.send_message("test message")
 
-            # ログイン状態チェックでFalseを返す
-            with patch.object(driver, '_check_login_status', return_value=False):
-                with pytest.raises(RuntimeError) as exc_info:
-                    driver.send_message("test message")
+        assert "ログイン" in str(exc_info.value)
 
-                assert "ログイン" in str(exc_info.value)
+    def test_send_message_stream_yields_increments(self, driver, monkeypatch):
+        """応答テキストの増分ストリーミングテスト"""
+        snapshots = [(_MARKDOWN_SELECTOR, text) for text in ("Hel", "Hello", "Hello wor", "Hello world")]
+        monkeypatch.setattr(driver, "_send_and_poll_response", lambda message: iter(snapshots))
 
-    def test_streaming_response_completion(self):
-        """ストリーミング応答完了検知テスト"""
-        # ドライバーインスタンス作成
-        driver = ChatGPTDriver()
+        # 最初の更新は応答要素のセレクターが定まるまで保留される
+        assert list(driver.send_message_stream("test")) == ["Hello", " wor", "ld"]
+        assert driver.send_message("test") == "Hello world"
 
+    def test_streaming_response_completion(self, driver, selenium_driver):
+        """ストリーミング応答完了検知テスト"""
         # モック要素を作成
         mock_element = Mock()
         mock_element.text = "Question: ジャンプする男\nThought: I need to generate an appropriate prompt for Stable Diffusion to create an image of a jumping man."
 
         # ストリーミング応答完了検知ロジックをテスト
-        with patch('drivers.selenium_wrapper.SeleniumWrapper') as mock_wrapper_class:
-            mock_wrapper = Mock()
-            mock_driver = Mock()
-            mock_wrapper.driver = mock_driver
-            mock_wrapper_class.get_instance.return_value = mock_wrapper
-
-            driver.selenium_wrapper = mock_wrapper
+        # モック設定: ストリーミングインジケーターが存在しない（完了状態）
+        selenium_driver.find_elements.return_value = []
 
-            # モック設定: ストリーミングインジケーターが存在しない（完了状態）
-            mock_driver.find_elements.return_value = []
+        # 応答完了判定をテスト（安定したテキストの場合）
+        result = driver._is_response_complete(mock_element, mock_element.text)
 
-            # 応答完了判定をテスト（安定したテキストの場合）
-            result = driver._is_response_complete(mock_element, mock_element.text)
+        # 短時間安定していれば完了と判定されることを確認
+        # 実際のテストでは時間調整が必要だが、ロジックの存在を確認
+        assert isinstance(result, bool)
 
-            # 短時間安定していれば完了と判定されることを確認
-            # 実際のテストでは時間調整が必要だが、ロジックの存在を確認
-            assert isinstance(result, bool)
-
-    def test_partial_response_detection(self):
+    def test_partial_response_detection(self, driver, selenium_driver):
         """部分応答検知テスト"""
-        driver = ChatGPTDriver()
 
         # 短すぎる応答（部分応答の可能性）
         mock_element = Mock()
         short_text = "Question: ジャンプ"  # 15文字程度
         mock_element.text = short_text
 
-        with patch('drivers.selenium_wrapper.SeleniumWrapper') as mock_wrapper_class:
-            mock_wrapper = Mock()
-            mock_driver = Mock()
-            mock_wrapper.driver = mock_driver
-            mock_wrapper_class.get_instance.return_value = mock_wrapper
-
-            driver.selenium_wrapper = mock_wrapper
-            mock_driver.find_elements.return_value = []
+        selenium_driver.find_elements.return_value = []
 
-            # 短すぎる応答は未完了と判定されることを確認
-            result = driver._is_response_complete(mock_element, mock_element.text)
-            assert result == False  # 短すぎるため継続すべき
+        # 短すぎる応答は未完了と判定されることを確認
+        result = driver._is_response_complete(mock_element, mock_element.text)
+        assert result == False  # 短すぎるため継続すべき
 
 
 class TestModels:
     """データモデルテストクラス"""
 
+    def test_function_message_role(self):
+        """Function roleメッセージテスト（スキーマとして受け入れられることを確認）"""
+        request = ChatCompletionRequest.model_validate({
+            "model": "gpt-3.5-turbo",
+            "messages": [
+                {"role": "user", "content": "What's the weather?"},
+                {
+                    "role": "assistant",
+                    "content": None,
+                    "function_call": {
+                        "name": "get_weather",
+                        "arguments": '{"location": "Tokyo"}'
+                    }
+                },
+                {
+                    "role": "function",
+                    "name": "get_weather",
+                    "content": '{"temperature": "22°C", "condition": "sunny"}'
+                }
+            ]
+        })
+        assert request.messages[-1].role == "function"
+        assert request.messages[-1].name == "get_weather"
+        assert request.messages[1].function_call.name == "get_weather"
+
     def test_chat_message_validation(self):
         """ChatMessageバリデーションテスト"""
         # 正常なメッセージ
@@ -676,12 +976,12 @@ class TestModels:
         message = ChatMessage(role="system", content="")
         assert message.content == ""
 
-    def test_chat_completion_request_validation(self):
+    def test_chat_completion_request_validation(self, user_msg):
         """ChatCompletionRequestバリデーションテスト"""
         # 必須フィールドのみ
         request = ChatCompletionRequest(
             model="gpt-3.5-turbo",
-            messages=[ChatMessage(role="user", content="Test")]
+            messages=[user_msg]
         )
         assert request.model == "gpt-3.5-turbo"
         assert len(request.messages) == 1
@@ -690,13 +990,25 @@ class TestModels:
         # オプションフィールド指定
         request = ChatCompletionRequest(
             model="gpt-4",
-            messages=[ChatMessage(role="user", content="Test")],
+            messages=[user_msg],
             max_tokens=100,
             temperature=0.5
         )
         assert request.max_tokens == 100
         assert request.temperature == 0.5
 
+    def test_response_object_literal(self):
+        """レスポンスのobjectフィールドは固定値のみ許可されることを確認"""
+        from pydantic import ValidationError
+        from models import ChatCompletionResponse, ChatCompletionUsage
+
+        usage = ChatCompletionUsage(prompt_tokens=1, completion_tokens=1, total_tokens=2)
+        response = ChatCompletionResponse(id="chatcmpl-test", created=0, model="gpt-4", choices=[], usage=usage)
+        assert response.object == "chat.completion"
+
+        with pytest.raises(ValidationError):
+            ChatCompletionResponse(id="chatcmpl-test", object="list", created=0, model="gpt-4", choices=[], usage=usage)
+
 
 class TestUtils:
     """ユーティリティ関数テストクラス"""
@@ -729,6 +1041,27 @@ class TestUtils:
         sanitized = sanitize_message(sensitive_msg)
         assert "***REDACTED***" in sanitized
 
+    @pytest.mark.parametrize("level, expected", [
+        ("info", logging.INFO),
+        ("WARN", logging.WARNING),
+        ("fatal", logging.CRITICAL),
+        ("NOTSET", logging.NOTSET),
+    ])
+    def test_setup_logging_level_names(self, monkeypatch, level, expected):
+        """ログレベル名（別名を含む）の解釈テスト"""
+        from utils import setup_logging
+
+        # ルートロガーを未設定の状態にし、実際の設定は行わない
+        monkeypatch.setattr(logging.getLogger(), "handlers", [])
+        basic_config = Mock()
+        monkeypatch.setattr(logging, "basicConfig", basic_config)
+
+        setup_logging(level)
+        assert basic_config.call_args.kwargs["level"] == expected
+
+        with pytest.raises(ValueError, match="Unknown log level"):
+            setup_logging("verbose")
+
     def test_create_error_response(self):
         """エラーレスポンス作成テスト"""
         from utils import create_error_response
@@ -745,48 +1078,32 @@ class TestBoundaryValues:
 
     def test_large_message_content(self):
         """大きなメッセージコンテンツテスト"""
-        large_content = "x" * 10000  # 10KB
-        message = ChatMessage(role="user", content=large_content)
+        message = ChatMessage(role="user", content=_LARGE_CONTENT)
         assert len(message.content) == 10000
 
-    def test_zero_max_tokens(self):
-        """max_tokens=0テスト"""
-        request = ChatCompletionRequest(
-            model="gpt-3.5-turbo",
-            messages=[ChatMessage(role="user", content="Test")],
-            max_tokens=0
-        )
-        assert request.max_tokens == 0
-
-    def test_extreme_temperature_values(self):
-        """極端なtemperature値テスト"""
-        # 最小値
-        request = ChatCompletionRequest(
-            model="gpt-3.5-turbo",
-            messages=[ChatMessage(role="user", content="Test")],
-            temperature=0.0
-        )
-        assert request.temperature == 0.0
-
-        # 最大値
+    @pytest.mark.parametrize("field,value", [
+        ("max_tokens", 0),
+        ("max_tokens", 1),
+        ("temperature", 0.0),  # 最小値
+        ("temperature", 2.0),  # 最大値
+    ])
+    def test_boundary_request(self, user_msg, field, value):
+        """max_tokens・temperatureの境界値テスト"""
         request = ChatCompletionRequest(
             model="gpt-3.5-turbo",
-            messages=[ChatMessage(role="user", content="Test")],
-            temperature=2.0
+            messages=[user_msg],
+            **{field: value}
         )
-        assert request.temperature == 2.0
+        assert getattr(request, field) == value
 
 
 # エラー推測法テスト
 class TestErrorGuessing:
     """エラー推測法テストクラス"""
 
-    def setup_method(self):
-        """テストメソッド前のセットアップ"""
-        self.client = TestClient(app)
-
     def test_no_user_messages(self):
         """ユーザーメッセージなしテスト"""
+        from services import ChatGPTService
         service = ChatGPTService()
         messages = [
             ChatMessage(role="system", content="System message"),
@@ -795,23 +1112,12 @@ class TestErrorGuessing:
         latest = service._get_latest_user_message(messages)
         assert latest is None
 
-    @patch('api.get_chatgpt_service')
-    def test_authentication_error_with_footer_detection(self, mock_get_service):
+    def test_authentication_error_with_footer_detection(self, mock_service, client):
         """認証エラーとフッター検出テスト"""
-        mock_service = MagicMock()
-        mock_get_service.return_value = mock_service
-
         # RuntimeError with login message
         mock_service.create_chat_completion.side_effect = RuntimeError("ChatGPTにログインしていません。手動でログインしてからAPIを使用してください。")
 
-        request_data = {
-            "model": "gpt-3.5-turbo",
-            "messages": [
-                {"role": "user", "content": "Test message"}
-            ]
-        }
-
-        response = self.client.post("/v1/chat/completions", json=request_data)
+        response = client.post("/v1/chat/completions", content=_BASIC_REQ_BODY, headers=_JSON_HEADERS)
         assert response.status_code == 401
         data = response.json()
         # FastAPIのHTTPExceptionはdetail内にエラー情報を格納
@@ -819,132 +1125,51 @@ class TestErrorGuessing:
         assert data["detail"]["error"]["code"] == "authentication_required"
         assert "ログイン" in data["detail"]["error"]["message"]
 
-    def test_login_state_check(self):
-        """ログイン状態チェック機能テスト"""
-        with patch('drivers.selenium_wrapper.SeleniumWrapper') as mock_wrapper_class:
-            mock_wrapper = Mock()
-            mock_driver = Mock()
-            mock_wrapper.driver = mock_driver
-            mock_wrapper_class.get_instance.return_value = mock_wrapper
-
-            driver = ChatGPTDriver()
-            driver.selenium_wrapper = mock_wrapper
-
-            # ログインボタンが存在する場合（未ログイン）
-            mock_driver.find_elements.return_value = [Mock(is_displayed=Mock(return_value=True))]
-            assert not driver._check_login_status()
-
-            # ChatGPT要素が存在する場合（ログイン済み）
-            def side_effect_func(by, selector):
-                if any(indicator in selector for indicator in ['login-button', 'signup-button', 'auth']):
-                    return []
-                elif any(indicator in selector for indicator in ['prompt-textarea', 'contenteditable', 'composer-button']):
-                    return [Mock(is_displayed=Mock(return_value=True))]
-                else:
-                    return []
-
-            mock_driver.find_elements.side_effect = side_effect_func
-            assert driver._check_login_status()
-
     def test_footer_text_rejection(self):
         """フッターテキスト拒否テスト"""
-        footer_patterns = [
-            "ChatGPT の回答は必ずしも正しいとは限りません",
-            "重要な情報は確認するようにしてください",
-            "ChatGPT にメッセージを送ると、規約に同意し",
-            "プライバシーポリシーを読んだものとみなされます",
-            "無料でサインアップ",
-            "ログイン"
-        ]
-
         # フッターテキストのサンプル
         footer_text = "ログイン\n無料でサインアップ\nChatGPT の回答は必ずしも正しいとは限りません。重要な情報は確認するようにしてください"
 
         # フッターパターンが検出されることを確認
-        is_footer = False
-        for pattern in footer_patterns:
-            if pattern in footer_text:
-                is_footer = True
-                break
-
-        assert is_footer, "Footer pattern should be detected"
+        assert _FOOTER_RE.search(footer_text), "Footer pattern should be detected"
+        # 各パターンが単独でも検出されることを確認
+        assert all(_FOOTER_RE.search(f"前置き{pattern}後置き") for pattern in _FOOTER_PATTERNS)
 
         # 正常な応答テキストは検出されないことを確認
         normal_response = "こんにちは！今日はどのようなお手伝いができますか？"
-        is_footer = False
-        for pattern in footer_patterns:
-            if pattern in normal_response:
-                is_footer = True
-                break
-
-        assert not is_footer, "Normal response should not be detected as footer"
-
-    @patch('api.get_chatgpt_service')
-    def test_comprehensive_login_error_handling(self, mock_get_service):
+        assert not _FOOTER_RE.search(normal_response), "Normal response should not be detected as footer"
+
+    @pytest.mark.parametrize("error_message", [
+        "ChatGPTにログインしていません",
+        "ログインセッションが期限切れです",
+        "ChatGPTの応答を正しく取得できませんでした。ログイン状態を確認してください"
+    ])
+    def test_comprehensive_login_error_handling(self, mock_service, client, error_message):
         """包括的ログインエラーハンドリングテスト"""
-        mock_service = MagicMock()
-        mock_get_service.return_value = mock_service
-
-        # Different types of login-related errors
-        login_errors = [
-            "ChatGPTにログインしていません",
-            "ログインセッションが期限切れです",
-            "ChatGPTの応答を正しく取得できませんでした。ログイン状態を確認してください"
-        ]
+        mock_service.create_chat_completion.side_effect = RuntimeError(error_message)
 
-        for error_message in login_errors:
-            mock_service.create_chat_completion.side_effect = RuntimeError(error_message)
-
-            request_data = {
-                "model": "gpt-3.5-turbo",
-                "messages": [
-                    {"role": "user", "content": "Test message"}
-                ]
-            }
+        response = client.post("/v1/chat/completions", content=_BASIC_REQ_BODY, headers=_JSON_HEADERS)
+        assert response.status_code == 401
+        data = response.json()
+        # FastAPIのHTTPExceptionはdetail内にエラー情報を格納
+        assert data["detail"]["error"]["type"] == "invalid_request_error"
+        assert data["detail"]["error"]["code"] == "authentication_required"
 
-            response = self.client.post("/v1/chat/completions", json=request_data)
-            assert response.status_code == 401
-            data = response.json()
-            # FastAPIのHTTPExceptionはdetail内にエラー情報を格納
-            assert data["detail"]["error"]["type"] == "invalid_request_error"
-            assert data["detail"]["error"]["code"] == "authentication_required"
+    def test_service_failure(self, mock_service, client):
         """サービス障害処理テスト"""
-        # モックサービス作成
-        mock_service = MagicMock()
         mock_service.create_chat_completion.return_value = None
-        mock_get_service.return_value = mock_service
-
-        client = TestClient(app)
-        request_data = {
-            "model": "gpt-3.5-turbo",
-            "messages": [{"role": "user", "content": "Test"}]
-        }
 
-        response = client.post("/v1/chat/completions", json=request_data)
+        response = client.post("/v1/chat/completions", content=_BASIC_REQ_BODY, headers=_JSON_HEADERS)
         assert response.status_code == 500
         data = response.json()
         assert "error" in data["detail"]
 
-    @patch('api.get_chatgpt_service')
-    def test_authentication_required_error(self, mock_get_service):
+    def test_authentication_required_error(self, mock_service, client):
         """認証必須エラーテスト"""
-        # モックサービス作成
-        mock_service = MagicMock()
-        mock_get_service.return_value = mock_service
-
         # ログイン関連のRuntimeErrorを発生させる
         mock_service.create_chat_completion.side_effect = RuntimeError("ChatGPTにログインしていません")
 
-        request_data = {
-            "model": "gpt-3.5-turbo",
-            "messages": [{"role": "user", "content": "Test"}]
-        }
-
-        response = self.client.post("/v1/chat/completions", json=request_data)
+        response = client.post("/v1/chat/completions", content=_BASIC_REQ_BODY, headers=_JSON_HEADERS)
         assert response.status_code == 401
         data = response.json()
         assert "authentication_required" in data["detail"]["error"]["code"]
-
-
-if __name__ == "__main__":
-    pytest.main([__file__, "-v"])
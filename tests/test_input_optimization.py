@@ -7,144 +7,184 @@
 - 統合テスト
 """
 
+import importlib
 import unittest
+import math
 import time
 import os
-from unittest.mock import patch, MagicMock
-from drivers import ChatGPTDriver
+from unittest.mock import patch, create_autospec
 from config import settings
 
 
 class TestInputOptimization(unittest.TestCase):
     """入力処理最適化テストクラス"""
 
+    @classmethod
+    def setUpClass(cls):
+        """クラス全体のセットアップ（SeleniumWrapperの差し替えとドライバー生成は1回だけ行い、全テストで共有する）"""
+        # drivers は Selenium を読み込むため、収集時ではなくここで初めて import する
+        try:
+            cls.ChatGPTDriver = importlib.import_module('drivers').ChatGPTDriver
+        except ImportError as e:
+            raise unittest.SkipTest(f"Drivers module not available: {e}")
+
+        from selenium.webdriver.remote.webdriver import WebDriver
+        from selenium.webdriver.remote.webelement import WebElement
+
+        # autospecで実在する属性だけを持つモックを1回だけ組み立てる（未知の子モックを自動生成しない）
+        cls._wrapper_patcher = patch('drivers.SeleniumWrapper', autospec=True)
+        mock_wrapper = cls._wrapper_patcher.start()
+
+        cls.mock_element = create_autospec(WebElement, instance=True)
+        cls.mock_driver = create_autospec(WebDriver, instance=True)
+        mock_wrapper.return_value.driver = cls.mock_driver
+
+        cls.driver = cls.ChatGPTDriver()
+        cls.driver.selenium_wrapper = mock_wrapper.return_value
+
+    @classmethod
+    def tearDownClass(cls):
+        """クラス全体の後片付け"""
+        cls._wrapper_patcher.stop()
+
     def setUp(self):
-        """テストセットアップ"""
-        self.driver = None
+        """テストセットアップ（共有モックの呼び出し履歴・戻り値・side_effectを初期化）"""
         self.original_settings = {}
 
+        self.mock_element.reset_mock(return_value=True, side_effect=True)
+        self.mock_element.text = ""
+        self.mock_element.is_displayed.return_value = True
+        self.mock_element.is_enabled.return_value = True
+
+        self.mock_driver.reset_mock(return_value=True, side_effect=True)
+        self.mock_driver.find_elements.return_value = [self.mock_element]
+
     def tearDown(self):
         """テストクリーンアップ"""
-        if self.driver:
-            try:
-                self.driver.cleanup()
-            except:
-                pass
-
-        # 設定を元に戻す
+        # 設定を元に戻し、ドライバーが保持する閾値も読み直す
         for key, value in self.original_settings.items():
             setattr(settings, key, value)
+        if self.original_settings:
+            self.driver.invalidate_settings_cache()
+
+    def test_strategy_matrix(self):
+        """送信戦略選択テスト（境界値・メッセージ長カテゴリ）"""
+        driver = self.driver
+
+        # (文字数, 期待する戦略, 説明)
+        cases = [
+            # 境界値
+            (149, "safe_single", "149文字は安全単一送信"),
+            (150, "safe_single", "150文字は境界で安全単一送信"),
+            (151, "try_single_fallback_chunk", "151文字は単一試行→フォールバック"),
+            (4000, "try_single_fallback_chunk", "4000文字は単一試行→フォールバック"),
+            (4001, "smart_chunking", "4001文字はスマートチャンキング"),
+            # 代表的なメッセージ長
+            (10, "safe_single", "超短文"),
+            (50, "safe_single", "短文"),
+            (100, "safe_single", "標準質問文"),
+            (500, "try_single_fallback_chunk", "中程度文書"),
+            (2000, "try_single_fallback_chunk", "長文"),
+            (8000, "smart_chunking", "超長文")
+        ]
+
+        for length, expected, description in cases:
+            with self.subTest(length=length, expected=expected):
+                strategy = driver._select_send_strategy(length)
+                self.assertEqual(strategy, expected,
+                                 f"{description}({length}文字)の戦略が不正: 期待={expected}, 実際={strategy}")
 
-    def test_boundary_value_send_strategy(self):
-        """境界値テスト：149, 150, 151文字での送信戦略"""
-        print("\n🧪 Test: 境界値での送信戦略選択")
+    def test_enhanced_cleanup_with_residual_data(self):
+        """残存データがある場合の段階的クリーンアップテスト"""
+        driver = self.driver
+        mock_element = self.mock_element
 
-        with patch('drivers.SeleniumWrapper') as mock_wrapper:
-            mock_driver = MagicMock()
-            mock_wrapper.return_value.driver = mock_driver
+        mock_element.get_attribute.side_effect = ["Pl", "Pl"]  # 入力欄に残存し、clear後も残る
 
-            driver = ChatGPTDriver()
+        # 段階的クリーンアップ実行
+        residual = driver._enhanced_cleanup(mock_element)
 
-            # 境界値テストケース
-            test_cases = [
-                (149, "safe_single", "149文字は安全単一送信"),
-                (150, "safe_single", "150文字は境界で安全単一送信"),
-                (151, "try_single_fallback_chunk", "151文字は単一試行→フォールバック"),
-                (4000, "try_single_fallback_chunk", "4000文字は単一試行→フォールバック"),
-                (4001, "smart_chunking", "4001文字はスマートチャンキング")
-            ]
+        # クリーンアップが実行されたことを確認
+        mock_element.clear.assert_called()
+        mock_element.send_keys.assert_any_call(unittest.mock.ANY)  # Ctrl+A
 
-            for message_length, expected_strategy, description in test_cases:
-                strategy = driver._select_send_strategy(message_length)
-                self.assertEqual(strategy, expected_strategy,
-                               f"{description}: 期待={expected_strategy}, 実際={strategy}")
-                print(f"✅ {description}: {strategy}")
+        self.assertEqual(residual, "Pl", "残存データが正しく検出された")
 
-    def test_enhanced_cleanup_with_residual_data(self):
-        """残存データがある場合の段階的クリーンアップテスト"""
-        print("\n🧪 Test: 残存データクリーンアップ")
+    def test_send_strategy_execution(self):
+        """送信戦略実行テスト"""
+        driver = self.driver
+        mock_element = self.mock_element
+        mock_driver = self.mock_driver
 
-        with patch('drivers.SeleniumWrapper') as mock_wrapper:
-            mock_element = MagicMock()
-            mock_element.get_attribute.side_effect = ["Pl", ""]  # 最初は残存、後はクリーン
-            mock_element.text = ""
-            mock_element.is_displayed.return_value = True
-            mock_element.is_enabled.return_value = True
+        # 各戦略のテスト
+        strategies = [
+            ("safe_single", "hello world", "短いメッセージの安全送信"),
+            ("try_single_fallback_chunk", "a" * 200, "中程度メッセージの単一試行"),
+            ("smart_chunking", "a" * 5000, "長いメッセージのスマート分割")
+        ]
 
-            mock_driver = MagicMock()
-            mock_driver.find_elements.return_value = [mock_element]
-            mock_wrapper.return_value.driver = mock_driver
+        for strategy, message, description in strategies:
+            with self.subTest(strategy=strategy):
+                mock_driver.execute_script.reset_mock()
+                mock_element.send_keys.reset_mock()
 
-            driver = ChatGPTDriver()
+                driver._execute_send_strategy(mock_element, message, strategy)
 
-            # 段階的クリーンアップ実行
-            residual = driver._enhanced_cleanup(mock_element)
+                # 1文字ずつのキー入力ではなく、JavaScriptでの一括挿入が使われる
+                mock_driver.execute_script.assert_called_once_with(unittest.mock.ANY, mock_element, message)
+                mock_element.send_keys.assert_not_called()
 
-            # クリーンアップが実行されたことを確認
-            mock_element.clear.assert_called()
-            mock_element.send_keys.assert_any_call(unittest.mock.ANY)  # Ctrl+A
+    def test_safe_single_falls_back_to_send_keys(self):
+        """JavaScriptでの挿入に失敗した場合の安全送信フォールバックテスト"""
+        driver = self.driver
+        mock_element = self.mock_element
+        mock_driver = self.mock_driver
 
-            self.assertEqual(residual, "Pl", "残存データが正しく検出された")
-            print("✅ 残存データ'Pl'が検出され、段階的クリーンアップが実行されました")
+        mock_driver.execute_script.return_value = False  # insertText非対応
 
-    def test_send_strategy_execution(self):
-        """送信戦略実行テスト"""
-        print("\n🧪 Test: 送信戦略実行")
+        driver._execute_send_strategy(mock_element, "hello world", "safe_single")
 
-        with patch('drivers.SeleniumWrapper') as mock_wrapper:
-            mock_element = MagicMock()
-            mock_element.is_displayed.return_value = True
-            mock_element.is_enabled.return_value = True
+        mock_driver.execute_script.assert_called_once()
+        mock_element.send_keys.assert_called_once_with("hello world")
 
-            mock_driver = MagicMock()
-            mock_driver.find_elements.return_value = [mock_element]
-            mock_wrapper.return_value.driver = mock_driver
+    def test_smart_chunking_uses_batched_js_paste(self):
+        """スマート分割送信がチャンクごとに1回の一括挿入で行われるテスト"""
+        driver = self.driver
+        mock_element = self.mock_element
+        mock_driver = self.mock_driver
 
-            driver = ChatGPTDriver()
+        # 3000文字の段落を3つ（チャンク上限4000文字のため段落ごとに1チャンク）
+        message = "\n\n".join(["a" * 3000] * 3)
+        chunk_size = 4000
 
-            # 各戦略のテスト
-            strategies = [
-                ("safe_single", "hello world", "短いメッセージの安全送信"),
-                ("try_single_fallback_chunk", "a" * 200, "中程度メッセージの単一試行"),
-                ("smart_chunking", "a" * 5000, "長いメッセージのスマート分割")
-            ]
+        with patch.object(driver, '_wait_for_stop_button_disappear') as mock_wait:
+            driver._send_message_with_smart_chunking(mock_element, message)
 
-            for strategy, message, description in strategies:
-                with self.subTest(strategy=strategy):
-                    driver._execute_send_strategy(mock_element, message, strategy)
-                    print(f"✅ {description}: {strategy}戦略実行完了")
+        self.assertEqual(mock_driver.execute_script.call_count, math.ceil(len(message) / chunk_size))
+        self.assertEqual(mock_wait.call_count, mock_driver.execute_script.call_count - 1)
+        mock_element.send_keys.assert_not_called()
 
     def test_performance_timing(self):
         """パフォーマンス測定テスト"""
-        print("\n🧪 Test: パフォーマンス測定")
-
-        with patch('drivers.SeleniumWrapper') as mock_wrapper:
-            mock_element = MagicMock()
-            mock_element.get_attribute.return_value = ""  # 残存データなし
-            mock_element.text = ""
-            mock_element.is_displayed.return_value = True
-            mock_element.is_enabled.return_value = True
+        driver = self.driver
+        mock_element = self.mock_element
 
-            mock_driver = MagicMock()
-            mock_driver.find_elements.return_value = [mock_element]
-            mock_wrapper.return_value.driver = mock_driver
+        mock_element.get_attribute.return_value = ""  # 残存データなし
 
-            driver = ChatGPTDriver()
+        # クリーンアップ処理の時間測定
+        start_time = time.perf_counter()
+        driver._enhanced_cleanup(mock_element)
+        cleanup_time = time.perf_counter() - start_time
 
-            # クリーンアップ処理の時間測定
-            start_time = time.time()
-            driver._enhanced_cleanup(mock_element)
-            cleanup_time = time.time() - start_time
-
-            # パフォーマンス目標（1秒以内）の確認
-            self.assertLess(cleanup_time, 1.0,
-                          f"クリーンアップ時間が目標を超過: {cleanup_time:.3f}秒")
-            print(f"✅ クリーンアップ時間: {cleanup_time:.3f}秒（目標<1.0秒）")
+        # パフォーマンス目標（1秒以内）の確認
+        self.assertLess(cleanup_time, 1.0,
+                      f"クリーンアップ時間が目標を超過: {cleanup_time:.3f}秒")
+        # 入力欄が空の場合はクリア操作を行わない
+        mock_element.clear.assert_not_called()
+        mock_element.send_keys.assert_not_called()
 
     def test_configuration_customization(self):
         """設定カスタマイズテスト"""
-        print("\n🧪 Test: 設定カスタマイズ")
-
         # 設定の保存
         self.original_settings['input_cleanup_delay'] = getattr(settings, 'input_cleanup_delay', 0.8)
         self.original_settings['safe_send_limit'] = getattr(settings, 'safe_send_limit', 150)
@@ -153,131 +193,76 @@ class TestInputOptimization(unittest.TestCase):
         settings.input_cleanup_delay = 0.5
         settings.safe_send_limit = 100
 
-        with patch('drivers.SeleniumWrapper') as mock_wrapper:
-            mock_driver = MagicMock()
-            mock_wrapper.return_value.driver = mock_driver
-
-            driver = ChatGPTDriver()
+        driver = self.driver
+        driver.invalidate_settings_cache()
 
-            # カスタム設定での戦略選択確認
-            strategy_99 = driver._select_send_strategy(99)
-            strategy_101 = driver._select_send_strategy(101)
+        # カスタム設定での戦略選択確認
+        strategy_99 = driver._select_send_strategy(99)
+        strategy_101 = driver._select_send_strategy(101)
 
-            self.assertEqual(strategy_99, "safe_single", "99文字はカスタム設定で安全送信")
-            self.assertEqual(strategy_101, "try_single_fallback_chunk", "101文字はカスタム設定で試行→フォールバック")
-
-            print(f"✅ カスタム設定適用: safe_limit={settings.safe_send_limit}, cleanup_delay={settings.input_cleanup_delay}")
+        self.assertEqual(strategy_99, "safe_single", "99文字はカスタム設定で安全送信")
+        self.assertEqual(strategy_101, "try_single_fallback_chunk", "101文字はカスタム設定で試行→フォールバック")
 
     def test_error_recovery(self):
         """エラー回復テスト"""
-        print("\n🧪 Test: エラー回復機能")
-
-        with patch('drivers.SeleniumWrapper') as mock_wrapper:
-            mock_element = MagicMock()
-            mock_element.send_keys.side_effect = [Exception("First attempt failed"), None]  # 1回目失敗、2回目成功
-            mock_element.is_displayed.return_value = True
-            mock_element.is_enabled.return_value = True
-
-            mock_driver = MagicMock()
-            mock_driver.find_elements.return_value = [mock_element]
-            mock_wrapper.return_value.driver = mock_driver
+        driver = self.driver
+        mock_element = self.mock_element
+        mock_driver = self.mock_driver
 
-            driver = ChatGPTDriver()
+        mock_driver.execute_script.side_effect = Exception("First attempt failed")  # JavaScriptでの一括挿入が失敗
 
-            # smart_chunkingメソッドをモック
-            with patch.object(driver, '_send_message_with_smart_chunking') as mock_chunking:
-                # エラー回復テスト（try_single_fallback_chunk戦略）
-                driver._execute_send_strategy(mock_element, "test message", "try_single_fallback_chunk")
+        # smart_chunkingメソッドをモック
+        with patch.object(driver, '_send_message_with_smart_chunking') as mock_chunking:
+            # エラー回復テスト（try_single_fallback_chunk戦略）
+            driver._execute_send_strategy(mock_element, "test message", "try_single_fallback_chunk")
 
-                # フォールバックが呼ばれたことを確認
-                mock_chunking.assert_called_once()
-                print("✅ 送信戦略エラー時のフォールバック機能が正常動作")
+            # フォールバックが呼ばれたことを確認
+            mock_chunking.assert_called_once()
 
     def test_negative_configuration_values(self):
         """ネガティブテスト：不正な設定値"""
-        print("\n🧪 Test: 不正な設定値のハンドリング")
-
-        with patch('drivers.SeleniumWrapper') as mock_wrapper:
-            mock_driver = MagicMock()
-            mock_wrapper.return_value.driver = mock_driver
-
-            driver = ChatGPTDriver()
-
-            # 不正な設定値テストケース
-            invalid_configs = [
-                (-1, "負の文字数制限"),
-                (0, "ゼロ文字数制限"),
-                (None, "None値設定")
-            ]
-
-            for invalid_value, description in invalid_configs:
-                # 設定の一時変更
-                original_value = getattr(settings, 'safe_send_limit', 150)
-                try:
-                    settings.safe_send_limit = invalid_value
-
-                    # 不正値でも適切にフォールバック処理される
-                    strategy = driver._select_send_strategy(100)
+        driver = self.driver
+
+        # 不正な設定値テストケース
+        invalid_configs = [
+            (-1, "負の文字数制限"),
+            (0, "ゼロ文字数制限"),
+            (None, "None値設定")
+        ]
+
+        for invalid_value, description in invalid_configs:
+            # 設定の一時変更
+            original_value = getattr(settings, 'safe_send_limit', 150)
+            try:
+                settings.safe_send_limit = invalid_value
+                driver.invalidate_settings_cache()
 
-                    # 不正値の場合はデフォルト値にフォールバック
-                    self.assertIn(strategy, ["safe_single", "try_single_fallback_chunk", "smart_chunking"],
-                                f"{description}でも有効な戦略が選択される")
-                    print(f"✅ {description}: フォールバック戦略={strategy}")
+                # 不正値でも適切にフォールバック処理される
+                strategy = driver._select_send_strategy(100)
 
-                except Exception as e:
-                    # 例外が発生した場合も適切なエラーハンドリング
-                    print(f"✅ {description}: 適切にエラーハンドリング={type(e).__name__}")
+                # 不正値の場合はデフォルト値（150文字）にフォールバック
+                self.assertEqual(strategy, "safe_single",
+                                 f"{description}でもデフォルトの閾値で戦略が選択される")
 
-                finally:
-                    # 設定を元に戻す
-                    settings.safe_send_limit = original_value
+            finally:
+                # 設定を元に戻す
+                settings.safe_send_limit = original_value
+                driver.invalidate_settings_cache()
 
     def test_real_browser_integration(self):
         """実ブラウザ統合テスト（オプション）"""
-        print("\n🧪 Test: 実ブラウザ統合テスト")
-
         if os.getenv('SKIP_BROWSER_TESTS', 'false').lower() == 'true':
             self.skipTest("Browser integration tests are disabled (SKIP_BROWSER_TESTS=true)")
 
         try:
-            driver = ChatGPTDriver()
+            driver = self.ChatGPTDriver()
 
             # 実際のブラウザでの初期化テスト
             # 注意: このテストは実際のChatGPTサイトにアクセスするため、
             # ネットワーク接続とブラウザ環境が必要
-            print("⚠️  実ブラウザテストはスキップされました（実装時は慎重に実行）")
-            print("   理由: 実際のChatGPTサイトへのアクセスが必要なため")
-
         except Exception as e:
             self.skipTest(f"Real browser test skipped due to: {e}")
 
-    def test_message_length_categories(self):
-        """メッセージ長カテゴリテスト"""
-        print("\n🧪 Test: メッセージ長カテゴリ分類")
-
-        with patch('drivers.SeleniumWrapper') as mock_wrapper:
-            mock_driver = MagicMock()
-            mock_wrapper.return_value.driver = mock_driver
-
-            driver = ChatGPTDriver()
-
-            # 各カテゴリの代表的メッセージ長テスト
-            categories = [
-                (10, "safe_single", "超短文"),
-                (50, "safe_single", "短文"),
-                (100, "safe_single", "標準質問文"),
-                (150, "safe_single", "安全限界"),
-                (500, "try_single_fallback_chunk", "中程度文書"),
-                (2000, "try_single_fallback_chunk", "長文"),
-                (8000, "smart_chunking", "超長文")
-            ]
-
-            for length, expected, category in categories:
-                strategy = driver._select_send_strategy(length)
-                self.assertEqual(strategy, expected,
-                               f"{category}({length}文字)の戦略が不正: 期待={expected}, 実際={strategy}")
-                print(f"✅ {category}({length}文字): {strategy}")
-
 
 if __name__ == "__main__":
     # テスト実行時の環境変数設定
@@ -4,11 +4,12 @@
 セキュリティ、パフォーマンス、互換性の観点から追加テスト
 """
 
+import importlib.util
 import sys
 import os
 import time
-import threading
 import unittest
+from concurrent.futures import ThreadPoolExecutor
 from unittest.mock import Mock, patch
 
 # プロジェクトルートをパスに追加
@@ -18,6 +19,15 @@ sys.path.insert(0, project_root)
 from models import ChatMessage, ChatCompletionRequest
 from utils import sanitize_message, generate_id, create_error_response
 
+try:
+    import psutil
+except ImportError:  # psutilがなければ空きメモリの確認を省略する
+    psutil = None
+
+# 大きな入力データテストに必要な空きメモリ（10MBの入力に対して余裕を持たせる）
+_LARGE_INPUT_SIZE = 10 * 1024 * 1024
+_LOW_MEMORY = psutil is not None and psutil.virtual_memory().available < 100 * 1024 * 1024
+
 
 class SecurityTests(unittest.TestCase):
     """セキュリティテストクラス"""
@@ -40,30 +50,50 @@ class SecurityTests(unittest.TestCase):
     def test_sensitive_data_sanitization(self):
         """機密データサニタイゼーションテスト"""
         sensitive_patterns = [
-            "password=secret123",
-            "token=abc123xyz",
-            "api_key=sk-1234567890",
-            "My secret is hidden",
-            "PASSWORD: admin123"
+            ("password=secret123", "secret123"),
+            ("token=abc123xyz", "abc123xyz"),
+            ("api_key=sk-1234567890", "sk-1234567890"),
+            ("My secret is hidden", "hidden"),
+            ("my secret is: hunter2", "hunter2"),
+            ("PASSWORD: admin123", "admin123"),
+            # 識別子の一部として含まれる場合
+            ("apiKey=sk-123", "sk-123"),
+            ("accessToken=abc", "abc"),
+            ("mypassword:hunter2", "hunter2"),
+            ("password123", "password123"),
         ]
 
-        for pattern in sensitive_patterns:
-            sanitized = sanitize_message(pattern)
-            self.assertIn("***REDACTED***", sanitized)
+        for pattern, value in sensitive_patterns:
+            with self.subTest(pattern=pattern):
+                sanitized = sanitize_message(pattern)
+                self.assertIn("***REDACTED***", sanitized)
+                self.assertNotIn(value, sanitized)
+
+        # 機密情報以外の部分はそのまま残る
+        self.assertEqual(sanitize_message("login ok, token=abc123 done"), "login ok, ***REDACTED*** done")
 
+        # 機密語を含むだけの別の単語は置換しない
+        for message in ("keyboard layout", "3 tokens left", "monkey business"):
+            with self.subTest(message=message):
+                self.assertEqual(sanitize_message(message), message)
+
+    @unittest.skipIf(_LOW_MEMORY, "Not enough free memory for the 10MB input test")
     def test_large_input_handling(self):
         """大きな入力データ処理テスト"""
         # 10MB の入力（DoS攻撃シミュレーション）
-        large_input = "x" * (10 * 1024 * 1024)
+        large_input = "x" * _LARGE_INPUT_SIZE
 
         # メモリ使用量を監視しながらテスト
-        start_time = time.time()
+        start_time = time.perf_counter()
         message = ChatMessage(role="user", content=large_input)
-        end_time = time.time()
+        end_time = time.perf_counter()
+        # 以降はモデル側の参照だけを残す
+        del large_input
 
         # 処理時間が妥当範囲内であることを確認
         self.assertLess(end_time - start_time, 5.0)  # 5秒以内
-        self.assertEqual(len(message.content), 10 * 1024 * 1024)
+        self.assertEqual(len(message.content), _LARGE_INPUT_SIZE)
+        self.assertEqual(message.content[:1], "x")
 
 
 class PerformanceTests(unittest.TestCase):
@@ -71,12 +101,12 @@ class PerformanceTests(unittest.TestCase):
 
     def test_id_generation_performance(self):
         """ID生成パフォーマンステスト"""
-        start_time = time.time()
+        start_time = time.perf_counter()
 
         # 1000個のIDを生成
         ids = [generate_id() for _ in range(1000)]
 
-        end_time = time.time()
+        end_time = time.perf_counter()
 
         # パフォーマンス確認
         self.assertLess(end_time - start_time, 1.0)  # 1秒以内
@@ -86,35 +116,23 @@ class PerformanceTests(unittest.TestCase):
 
     def test_concurrent_request_handling(self):
         """並行リクエスト処理テスト"""
-        results = []
-
-        def create_message():
-            message = ChatMessage(role="user", content="Test message")
-            results.append(message)
+        def create_message(_):
+            return ChatMessage(role="user", content="Test message")
 
-        # 10個の並行スレッドで実行
-        threads = []
-        for _ in range(10):
-            thread = threading.Thread(target=create_message)
-            threads.append(thread)
-            thread.start()
+        # 10個のワーカーを持つスレッドプールで並行実行（結果はmapが順に集める）
+        with ThreadPoolExecutor(max_workers=10) as executor:
+            results = list(executor.map(create_message, range(10)))
 
-        for thread in threads:
-            thread.join()
-
-        # 全てのスレッドが正常に完了したことを確認
+        # 全てのタスクが正常に完了したことを確認
         self.assertEqual(len(results), 10)
         for result in results:
             self.assertEqual(result.content, "Test message")
 
     def test_memory_usage_with_large_messages(self):
         """大きなメッセージでのメモリ使用量テスト"""
-        # 複数の大きなメッセージを作成
-        messages = []
-        for i in range(10):
-            content = f"Large message {i}: " + "x" * 100000  # 100KB each
-            message = ChatMessage(role="user", content=content)
-            messages.append(message)
+        # 複数の大きなメッセージを作成（共通の100KB部分はループの外で1回だけ生成する）
+        bulk = "x" * 100000  # 100KB each
+        messages = [ChatMessage(role="user", content=f"Large message {i}: {bulk}") for i in range(10)]
 
         # メッセージが正常に作成されることを確認
         self.assertEqual(len(messages), 10)
@@ -243,52 +261,16 @@ class ErrorHandlingTests(unittest.TestCase):
 
 
 def run_quality_tests():
-    """品質保証テスト実行"""
-    print("ChatGPT Selenium API - Quality Assurance Tests")
-    print("=" * 60)
-
-    loader = unittest.TestLoader()
-    suite = unittest.TestSuite()
-
-    # 全QAテストクラスを追加
-    qa_test_classes = [
-        SecurityTests,
-        PerformanceTests,
-        CompatibilityTests,
-        ErrorHandlingTests
-    ]
-
-    for test_class in qa_test_classes:
-        suite.addTests(loader.loadTestsFromTestCase(test_class))
-
-    runner = unittest.TextTestRunner(verbosity=2)
-    result = runner.run(suite)
-
-    print("\n" + "=" * 60)
-    print(f"QA Test Summary:")
-    print(f"  Tests run: {result.testsRun}")
-    print(f"  Failures: {len(result.failures)}")
-    print(f"  Errors: {len(result.errors)}")
-    print(f"  Skipped: {len(result.skipped) if hasattr(result, 'skipped') else 0}")
-
-    if result.failures:
-        print("\nFailures:")
-        for test, traceback in result.failures:
-            print(f"  - {test}: {traceback}")
-
-    if result.errors:
-        print("\nErrors:")
-        for test, traceback in result.errors:
-            print(f"  - {test}: {traceback}")
-
-    success = len(result.failures) == 0 and len(result.errors) == 0
-
-    if success:
-        print("\n🎉 All QA tests passed!")
-    else:
-        print("\n❌ Some QA tests failed!")
-
-    return success
+    """品質保証テスト実行
+
+    各テストクラスは状態を共有しないため、pytest-xdistがあればワーカーに分散して並列実行する。
+    """
+    import pytest
+
+    args = ["-x", __file__]
+    if importlib.util.find_spec("xdist") is not None:
+        args += ["-n", "auto"]
+    return pytest.main(args) == 0
 
 
 if __name__ == "__main__":
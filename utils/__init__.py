@@ -1,13 +1,23 @@
 import logging
+import re
+import secrets
 import time
 from typing import Dict, Any
 
 
 def setup_logging(level: str = "INFO") -> None:
-    """ログ設定をセットアップ"""
+    """ログ設定をセットアップ（ルートロガーが設定済みなら何もしない）"""
+    if logging.getLogger().handlers:
+        return
+
+    # WARN・FATAL・NOTSETなどの別名もloggingモジュールの対応表で数値に変換する
+    numeric_level = logging.getLevelName(level.upper())
+    if not isinstance(numeric_level, int):
+        raise ValueError(f"Unknown log level: {level}")
+
     log_format = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
     logging.basicConfig(
-        level=getattr(logging, level.upper()),
+        level=numeric_level,
         format=log_format,
         datefmt="%Y-%m-%d %H:%M:%S"
     )
@@ -15,11 +25,8 @@ def setup_logging(level: str = "INFO") -> None:
 
 def generate_id(prefix: str = "chatcmpl") -> str:
     """ユニークIDを生成"""
-    import random
-    import uuid
-    timestamp = str(int(time.time() * 1000000))  # マイクロ秒精度
-    random_suffix = str(uuid.uuid4())[:8]  # UUIDの一部を使用
-    return f"{prefix}-{timestamp}-{random_suffix}"
+    # 64ビットの乱数で一意性を確保する（作成時刻はレスポンスのcreatedで別途返す）
+    return f"{prefix}-{secrets.token_hex(8)}"
 
 
 def get_current_timestamp() -> int:
@@ -27,16 +34,23 @@ def get_current_timestamp() -> int:
     return int(time.time())
 
 
+# 機密性の高い文字列（大文字小文字を区別せず、1回の走査でまとめて照合する）
+# 「password=xxx」「apiKey: xxx」「secret is: xxx」のように値が続く場合は、
+# 識別子の一部（apiKey・accessTokenなど）でも識別子と値を含めて置換する
+# 値が続かない場合は単語単位（「password123」のような数字付きを含む）で照合し、「keyboard」「tokens」などは置換しない
+_SENSITIVE_PATTERNS = ["password", "token", "key", "secret"]
+_SENSITIVE_KEYWORDS = "(?:" + "|".join(map(re.escape, _SENSITIVE_PATTERNS)) + ")"
+_SENSITIVE_RE = re.compile(
+    r"(?<![\w-])[\w-]*" + _SENSITIVE_KEYWORDS + r"[\w-]*\s*(?:[:=]|\bis\b:?)\s*\S+"
+    r"|(?<![^\W_])" + _SENSITIVE_KEYWORDS + r"\d*\b",
+    re.IGNORECASE
+)
+
+
 def sanitize_message(message: str) -> str:
     """メッセージをサニタイズ"""
-    # 機密情報のログ出力を防ぐため、機密性の高い文字列をマスク
-    sensitive_patterns = ["password", "token", "key", "secret"]
-    sanitized = message
-    for pattern in sensitive_patterns:
-        if pattern.lower() in message.lower():
-            sanitized = sanitized.replace(message, "***REDACTED***")
-            break
-    return sanitized
+    # 機密情報のログ出力を防ぐため、機密性の高い文字列（と続く値）だけをマスクする
+    return _SENSITIVE_RE.sub("***REDACTED***", message)
 
 
 def create_error_response(error_code: str, error_message: str) -> Dict[str, Any]: